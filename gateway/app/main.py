@@ -1,22 +1,30 @@
 import asyncio
+import base64
 import hashlib
 import json
 import os
 import secrets
+import threading
 import time
 import uuid
+from collections.abc import Iterator
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from typing import Any, Literal
 
 import httpx
+import jwt
+import orjson
 import psycopg
 from fastapi import BackgroundTasks, Cookie, Depends, FastAPI, File, Form, Header, Query, Request, Response, UploadFile
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from jose import JWTError, jwt
 from passlib.context import CryptContext
 from pydantic import BaseModel, EmailStr, Field
 from psycopg.rows import dict_row
+from psycopg_pool import ConnectionPool
 
 
 class ApiError(Exception):
@@ -34,7 +42,7 @@ class RegisterRequest(BaseModel):
 
 
 class LoginRequest(BaseModel):
-    email: EmailStr
+    email: str
     password: str
 
 
@@ -220,8 +228,15 @@ class CourseCreateRequest(BaseModel):
     provider_override: Literal["local", "api"] | None = None
 
 
-app = FastAPI(title="Gateway Service", version="2.0.0")
-password_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    yield
+    await close_internal_http_client()
+    close_db_pool()
+
+
+app = FastAPI(title="Gateway Service", version="2.0.0", default_response_class=ORJSONResponse, lifespan=lifespan)
+password_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=int(os.getenv("BCRYPT_ROUNDS", "12")))
 bearer_security = HTTPBearer(auto_error=False)
 started_at = datetime.now(timezone.utc)
 
@@ -285,6 +300,22 @@ STATIC_EXAMPLES = {
 
 rate_limit_state: dict[str, list[float]] = {}
 
+IMPERSONATION_TOKEN_TTL_SECONDS = 30
+IMPERSONATION_TOKEN_CACHE_SIZE = 1024
+impersonation_tokens: dict[tuple[str, str, str, str, str], tuple[float, str]] = {}
+
+AUTH_CACHE_MAX_SIZE = 10000
+auth_user_cache: dict[str, tuple[float, dict[str, Any]]] = {}
+
+db_pool: ConnectionPool | None = None
+db_pool_lock = threading.Lock()
+
+internal_http_client: httpx.AsyncClient | None = None
+
+payments_buffer: list[dict[str, Any]] = []
+payments_buffer_lock = threading.Lock()
+payments_flush_lock = threading.Lock()
+
 
 def now_utc() -> datetime:
     return datetime.now(timezone.utc)
@@ -307,6 +338,24 @@ def json_load(value: Any, default: Any) -> Any:
     return default
 
 
+def weak_etag(*stamps: datetime | None) -> str:
+    return 'W/"' + "-".join(f"{stamp.timestamp():.6f}" if stamp else "0" for stamp in stamps) + '"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = {item.strip() for item in header.split(",")}
+    return "*" in candidates or etag in candidates or etag[2:] in candidates
+
+
+def normalize_login_email(email: str) -> str:
+    # Mirrors EmailStr normalization used at signup: only the domain part is case-folded.
+    local, _, domain = email.strip().rpartition("@")
+    return f"{local}@{domain.lower()}" if local else email.strip()
+
+
 def bool_env(name: str, default: bool) -> bool:
     value = os.getenv(name)
     if value is None:
@@ -314,26 +363,94 @@ def bool_env(name: str, default: bool) -> bool:
     return value.lower() in {"1", "true", "yes", "on"}
 
 
+@dataclass(frozen=True, slots=True)
+class Settings:
+    postgres_url: str
+    jwt_secret: str
+    jwt_algorithm: str
+    jwt_algorithms: list[str]
+    jwt_expire_minutes: int
+    refresh_expire_days: int
+    auth_cache_user_ttl: float
+    internal_token: str
+    ingestion_url: str
+    course_builder_url: str
+    max_upload_bytes: int
+
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    algorithm = os.getenv("JWT_ALGORITHM", "HS256")
+    return Settings(
+        postgres_url=os.getenv("POSTGRES_URL", ""),
+        jwt_secret=os.getenv("JWT_SECRET", ""),
+        jwt_algorithm=algorithm,
+        jwt_algorithms=[algorithm],
+        jwt_expire_minutes=int(os.getenv("JWT_EXPIRE_MINUTES", "60")),
+        refresh_expire_days=int(os.getenv("REFRESH_EXPIRE_DAYS", "30")),
+        auth_cache_user_ttl=float(os.getenv("AUTH_CACHE_USER_TTL", "60")),
+        internal_token=os.getenv("INTERNAL_TOKEN", "").strip(),
+        ingestion_url=os.getenv("INGESTION_URL", "http://ingestion-java:8080"),
+        course_builder_url=os.getenv("COURSE_BUILDER_URL", "http://course-builder:8000"),
+        max_upload_bytes=int(os.getenv("MAX_UPLOAD_BYTES", str(100 * 1024 * 1024))),
+    )
+
+
 def postgres_url() -> str:
-    value = os.getenv("POSTGRES_URL", "")
+    value = get_settings().postgres_url
     if not value:
         raise ApiError(code="MISSING_POSTGRES_URL", message="POSTGRES_URL is required", status_code=500)
     return value
 
 
 def jwt_secret() -> str:
-    value = os.getenv("JWT_SECRET", "")
+    value = get_settings().jwt_secret
     if not value:
         raise ApiError(code="MISSING_JWT_SECRET", message="JWT_SECRET is required", status_code=500)
     return value
 
 
 def jwt_algorithm() -> str:
-    return os.getenv("JWT_ALGORITHM", "HS256")
+    return get_settings().jwt_algorithm
+
+
+def db_prepare_threshold() -> int | None:
+    value = os.getenv("DB_PREPARE_THRESHOLD", "1").strip()
+    return int(value) if value else None
+
+
+def get_db_pool() -> ConnectionPool:
+    global db_pool
+    if db_pool is None:
+        with db_pool_lock:
+            if db_pool is None:
+                db_pool = ConnectionPool(
+                    postgres_url(),
+                    min_size=int(os.getenv("DB_POOL_MIN_SIZE", "2")),
+                    max_size=int(os.getenv("DB_POOL_MAX_SIZE", "20")),
+                    max_idle=300,
+                    check=ConnectionPool.check_connection,
+                    kwargs={"autocommit": True, "prepare_threshold": db_prepare_threshold()},
+                    open=True,
+                )
+    return db_pool
+
+
+def close_db_pool() -> None:
+    global db_pool
+    if db_pool is not None:
+        db_pool.close()
+        db_pool = None
 
 
-def db_connect(*, autocommit: bool = True) -> psycopg.Connection:
-    return psycopg.connect(postgres_url(), autocommit=autocommit)
+@contextmanager
+def db_connect(*, autocommit: bool = True) -> Iterator[psycopg.Connection]:
+    with get_db_pool().connection() as connection:
+        if autocommit:
+            yield connection
+        else:
+            with connection.transaction():
+                yield connection
 
 
 def db_fetchone(query: str, params: tuple[Any, ...] = ()) -> dict[str, Any] | None:
@@ -357,12 +474,18 @@ def db_execute(query: str, params: tuple[Any, ...] = ()) -> int:
             return cursor.rowcount
 
 
+def db_executemany(query: str, params_seq: list[tuple[Any, ...]]) -> None:
+    with db_connect() as connection:
+        with connection.transaction(), connection.cursor() as cursor:
+            cursor.executemany(query, params_seq)
+
+
 def hash_token(value: str) -> str:
     return hashlib.sha256(value.encode("utf-8")).hexdigest()
 
 
 def create_access_token(user_id: str, email: str, role: str = "user", plan: str = "free") -> str:
-    lifetime_minutes = int(os.getenv("JWT_EXPIRE_MINUTES", "60"))
+    lifetime_minutes = get_settings().jwt_expire_minutes
     expires_at = now_utc() + timedelta(minutes=lifetime_minutes)
     payload = {
         "sub": user_id,
@@ -376,7 +499,7 @@ def create_access_token(user_id: str, email: str, role: str = "user", plan: str
 
 def create_refresh_token(user_id: str) -> tuple[str, datetime]:
     token = secrets.token_urlsafe(48)
-    expires_at = now_utc() + timedelta(days=int(os.getenv("REFRESH_EXPIRE_DAYS", "30")))
+    expires_at = now_utc() + timedelta(days=get_settings().refresh_expire_days)
     token_hash = hash_token(token)
     db_execute(
         """
@@ -444,7 +567,7 @@ def issue_auth_payload(response: Response, user: dict[str, Any]) -> dict[str, An
     return {
         "access_token": access_token,
         "token_type": "bearer",
-        "expires_at": (now_utc() + timedelta(minutes=int(os.getenv("JWT_EXPIRE_MINUTES", "60")))).isoformat(),
+        "expires_at": (now_utc() + timedelta(minutes=get_settings().jwt_expire_minutes)).isoformat(),
         "user": serialize_user(user),
     }
 
@@ -464,6 +587,174 @@ def enforce_rate_limit(scope: str, key: str, limit: int, window_seconds: int) ->
     rate_limit_state[bucket_key] = timestamps
 
 
+def issue_impersonation_token(admin_id: str, target_id: str, email: str, role: str, plan: str) -> str:
+    key = (admin_id, target_id, email, role, plan)
+    now_ts = time.monotonic()
+    cached = impersonation_tokens.get(key)
+    if cached and cached[0] > now_ts:
+        return cached[1]
+
+    if len(impersonation_tokens) >= IMPERSONATION_TOKEN_CACHE_SIZE:
+        for stale_key in [item_key for item_key, (expires, _) in impersonation_tokens.items() if expires <= now_ts]:
+            impersonation_tokens.pop(stale_key, None)
+        if len(impersonation_tokens) >= IMPERSONATION_TOKEN_CACHE_SIZE:
+            impersonation_tokens.clear()
+
+    token = create_access_token(user_id=target_id, email=email, role=role, plan=plan)
+    impersonation_tokens[key] = (now_ts + IMPERSONATION_TOKEN_TTL_SECONDS, token)
+    return token
+
+
+def encode_page_cursor(sort_value: datetime, row_id: Any) -> str:
+    raw = f"{sort_value.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_page_cursor(cursor: str) -> tuple[datetime, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        sort_value, row_id = raw.split("|", 1)
+        return datetime.fromisoformat(sort_value), str(uuid.UUID(row_id))
+    except ValueError as error:
+        raise ApiError(code="INVALID_CURSOR", message="Pagination cursor is invalid", status_code=400) from error
+
+
+SQL_SOURCE_DETAILS = """
+    SELECT
+      u.status AS user_status,
+      s.id,
+      s.type,
+      s.name,
+      s.status,
+      s.updated_at,
+      j.id AS job_id,
+      j.status AS job_status,
+      j.error,
+      j.updated_at AS job_updated_at
+    FROM users u
+    LEFT JOIN sources s
+      ON s.id = %s
+     AND (s.user_id = u.id OR s.user_id IS NULL)
+    LEFT JOIN LATERAL (
+        SELECT id, status, error, updated_at
+        FROM jobs
+        WHERE source_id = s.id
+        ORDER BY created_at DESC
+        LIMIT 1
+    ) j ON TRUE
+    WHERE u.id = %s
+      AND u.deleted_at IS NULL
+"""
+
+
+SQL_COURSE_DETAILS = """
+    SELECT u.status AS user_status, c.id, c.title, c.goal, c.level, c.structure_json, c.updated_at
+    FROM users u
+    LEFT JOIN courses c
+      ON c.id = %s
+     AND (c.user_id = u.id OR c.user_id IS NULL)
+    WHERE u.id = %s
+      AND u.deleted_at IS NULL
+"""
+
+
+SQL_BUILD_DETAILS = """
+    SELECT cb.*
+    FROM course_builds cb
+    JOIN courses c ON c.id = cb.course_id
+    LEFT JOIN workspaces w ON w.id = c.workspace_id
+    LEFT JOIN workspace_members wm ON wm.workspace_id = c.workspace_id AND wm.user_id = %s
+    WHERE cb.id = %s
+      AND (c.owner_user_id = %s OR wm.user_id IS NOT NULL OR %s = 'admin')
+"""
+
+
+SQL_LOGIN_USER = """
+    SELECT id, email, name, role, plan, status, password_hash, deleted_at
+    FROM users
+    WHERE email = %s
+"""
+
+
+@lru_cache(maxsize=32)
+def build_admin_users_sql(has_q: bool, has_status: bool, has_plan: bool, has_cursor: bool) -> str:
+    conditions = ["deleted_at IS NULL"]
+    if has_q:
+        conditions.append("(email ILIKE %s OR name ILIKE %s)")
+    if has_status:
+        conditions.append("status = %s")
+    if has_plan:
+        conditions.append("plan = %s")
+    if has_cursor:
+        conditions.append("(created_at, id) < (%s, %s)")
+    pagination = "LIMIT %s" if has_cursor else "LIMIT %s OFFSET %s"
+    return f"""
+        SELECT id::text AS id, email, name, role, plan, status, created_at, last_login_at
+        FROM users
+        WHERE {' AND '.join(conditions)}
+        ORDER BY created_at DESC, id DESC
+        {pagination}
+        """
+
+
+@lru_cache(maxsize=16)
+def build_admin_courses_sql(has_q: bool, has_status: bool, has_cursor: bool) -> str:
+    conditions = ["c.deleted_at IS NULL"]
+    if has_q:
+        conditions.append("(c.title ILIKE %s OR c.goal ILIKE %s)")
+    if has_status:
+        conditions.append("c.status = %s")
+    if has_cursor:
+        conditions.append("(c.updated_at, c.id) < (%s, %s)")
+    pagination = "LIMIT %s" if has_cursor else "LIMIT %s OFFSET %s"
+    return f"""
+        SELECT
+          c.id::text AS id,
+          c.workspace_id::text AS workspace_id,
+          c.owner_user_id::text AS owner_user_id,
+          c.title,
+          c.description,
+          c.goal,
+          c.level,
+          c.format,
+          c.pace_minutes_per_day,
+          c.status,
+          c.visibility,
+          c.progress_json,
+          c.created_at,
+          c.updated_at
+        FROM courses c
+        WHERE {' AND '.join(conditions)}
+        ORDER BY c.updated_at DESC, c.id DESC
+        {pagination}
+        """
+
+
+@lru_cache(maxsize=8)
+def build_admin_feedback_sql(has_status: bool, has_type: bool) -> str:
+    conditions = ["1=1"]
+    if has_status:
+        conditions.append("status = %s")
+    if has_type:
+        conditions.append("type = %s")
+    return f"""
+        SELECT
+          id::text AS id,
+          user_id::text AS user_id,
+          course_id::text AS course_id,
+          lesson_id::text AS lesson_id,
+          type,
+          message,
+          COALESCE(meta, '{{}}'::jsonb)::text AS meta,
+          status,
+          created_at,
+          updated_at
+        FROM feedback_reports
+        WHERE {' AND '.join(conditions)}
+        ORDER BY created_at DESC
+        """
+
+
 def validate_plan(value: str) -> None:
     if value not in PLAN_LIMITS:
         raise ApiError(code="INVALID_PLAN", message="Unsupported plan", status_code=400)
@@ -551,6 +842,47 @@ def enforce_plan_limit(user: dict[str, Any], limit_type: str, incoming_value: in
         )
 
 
+def record_payment(params: tuple[Any, ...]) -> None:
+    # Group commit: whoever holds the flush lock writes every pending payment in one
+    # round-trip, so concurrent webhooks share a flush while each caller still
+    # returns only after its own row is stored.
+    entry: dict[str, Any] = {"params": params, "done": False, "error": None}
+    with payments_buffer_lock:
+        payments_buffer.append(entry)
+
+    with payments_flush_lock:
+        if not entry["done"]:
+            with payments_buffer_lock:
+                batch = list(payments_buffer)
+                payments_buffer.clear()
+
+            query = """
+                INSERT INTO payments (subscription_id, amount, currency, status, provider_payload)
+                VALUES (%s, %s, %s, %s, %s::jsonb)
+            """
+            try:
+                if len(batch) == 1:
+                    db_execute(query, batch[0]["params"])
+                else:
+                    db_executemany(query, [item["params"] for item in batch])
+            except Exception as exc:
+                if len(batch) == 1:
+                    batch[0]["error"] = exc
+                else:
+                    # The batch is one transaction, so nothing was stored; replay row by row
+                    # so only the caller whose payment is bad sees the error.
+                    for item in batch:
+                        try:
+                            db_execute(query, item["params"])
+                        except Exception as row_exc:
+                            item["error"] = row_exc
+            for item in batch:
+                item["done"] = True
+
+    if entry["error"] is not None:
+        raise entry["error"]
+
+
 def serialize_user(row: dict[str, Any]) -> dict[str, Any]:
     return {
         "id": str(row["id"]),
@@ -829,9 +1161,31 @@ def build_upload_url(material_id: str) -> str:
     return f"{base}/{material_id}"
 
 
-def make_course_progress(course_id: str) -> dict[str, Any]:
+def count_course_lessons(course_id: str) -> int:
     total_row = db_fetchone("SELECT COUNT(*)::int AS total FROM lessons WHERE course_id = %s", (course_id,))
-    total_lessons = int((total_row or {}).get("total") or 0)
+    return int((total_row or {}).get("total") or 0)
+
+
+def build_progress_response(state: dict[str, Any], total: int) -> dict[str, Any]:
+    completed_lessons = json_load(state.get("completed_lessons"), [])
+    percent = round((len(completed_lessons) / total) * 100, 2) if total > 0 else 0
+    return {
+        "current_lesson_id": str(state["current_lesson_id"]) if state.get("current_lesson_id") else None,
+        "completed_lessons": completed_lessons,
+        "quiz_attempts": json_load(state.get("quiz_attempts"), []),
+        "streak_days": int(state.get("streak_days") or 0),
+        "last_activity_at": state.get("last_activity_at"),
+        "aggregate": {
+            "percent": percent,
+            "completed_lessons": len(completed_lessons),
+            "total_lessons": total,
+            "streak": int(state.get("streak_days") or 0),
+        },
+    }
+
+
+def make_course_progress(course_id: str) -> dict[str, Any]:
+    total_lessons = count_course_lessons(course_id)
     return {
         "percent": 0,
         "completed_lessons": 0,
@@ -1019,7 +1373,6 @@ def replace_outline(course_id: str, outline: dict[str, Any]) -> dict[str, Any]:
                 """,
                 (json_dumps({"modules": normalized_modules}), course_id),
             )
-        connection.commit()
 
     return {"modules": normalized_modules}
 
@@ -1376,6 +1729,33 @@ def serialize_course(row: dict[str, Any]) -> dict[str, Any]:
     }
 
 
+def serialize_template(row: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "id": str(row["id"]),
+        "name": row["name"],
+        "description": row["description"],
+        "schema": json_load(row.get("schema"), {}),
+        "is_active": row["is_active"],
+        "created_at": row["created_at"],
+        "updated_at": row["updated_at"],
+    }
+
+
+def serialize_feedback(row: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "id": row["id"],
+        "user_id": row["user_id"],
+        "course_id": row["course_id"],
+        "lesson_id": row["lesson_id"],
+        "type": row["type"],
+        "message": row["message"],
+        "meta": orjson.Fragment(row["meta"]),
+        "status": row["status"],
+        "created_at": row["created_at"],
+        "updated_at": row["updated_at"],
+    }
+
+
 def serialize_build(row: dict[str, Any], include_debug: bool = False) -> dict[str, Any]:
     payload = {
         "id": str(row["id"]),
@@ -1395,17 +1775,11 @@ def serialize_build(row: dict[str, Any], include_debug: bool = False) -> dict[st
     return payload
 
 
-async def current_user(credentials: HTTPAuthorizationCredentials = Depends(bearer_security)) -> dict[str, Any]:
-    if credentials is None:
-        raise ApiError(code="UNAUTHORIZED", message="Authorization token is required", status_code=401)
-
-    try:
-        payload = jwt.decode(credentials.credentials, jwt_secret(), algorithms=[jwt_algorithm()])
-        user_id = payload.get("sub")
-        if not user_id:
-            raise ApiError(code="UNAUTHORIZED", message="Token payload is invalid", status_code=401)
-    except JWTError as error:
-        raise ApiError(code="UNAUTHORIZED", message="Token is invalid or expired", status_code=401) from error
+def load_auth_user(user_id: str) -> dict[str, Any] | None:
+    now_ts = time.monotonic()
+    cached = auth_user_cache.get(user_id)
+    if cached and cached[0] > now_ts:
+        return cached[1]
 
     user = db_fetchone(
         """
@@ -1416,13 +1790,85 @@ async def current_user(credentials: HTTPAuthorizationCredentials = Depends(beare
         (user_id,),
     )
 
+    ttl_seconds = get_settings().auth_cache_user_ttl
+    if user and ttl_seconds > 0:
+        if len(auth_user_cache) >= AUTH_CACHE_MAX_SIZE:
+            auth_user_cache.clear()
+        auth_user_cache[user_id] = (now_ts + ttl_seconds, user)
+    return user
+
+
+def invalidate_auth_user(user_id: Any) -> None:
+    auth_user_cache.pop(str(user_id), None)
+
+
+def decode_bearer_subject(authorization: str | None) -> tuple[str | None, str]:
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None, "Authorization token is required"
+
+    try:
+        payload = jwt.decode(token, jwt_secret(), algorithms=get_settings().jwt_algorithms)
+    except jwt.InvalidTokenError:
+        return None, "Token is invalid or expired"
+
+    user_id = payload.get("sub")
+    if not user_id:
+        return None, "Token payload is invalid"
+    return str(user_id), ""
+
+
+class AuthContextMiddleware:
+    """Decodes the bearer token once per request and leaves the outcome in scope state.
+
+    Rejection is left to the route dependencies, so public endpoints stay reachable
+    with a stale or missing token.
+    """
+
+    def __init__(self, app: Any):
+        self.app = app
+
+    async def __call__(self, scope: dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] == "http":
+            authorization = None
+            for name, value in scope["headers"]:
+                if name == b"authorization":
+                    authorization = value.decode("latin-1")
+                    break
+            if authorization is not None:
+                state = scope.setdefault("state", {})
+                try:
+                    state["auth_subject"], state["auth_error"] = decode_bearer_subject(authorization)
+                except ApiError as error:
+                    # Raised here it would bypass the exception handlers; token_user_id re-raises it.
+                    state["auth_subject"], state["auth_error"] = None, error
+        await self.app(scope, receive, send)
+
+
+async def token_user_id(request: Request, _: HTTPAuthorizationCredentials | None = Depends(bearer_security)) -> str:
+    # bearer_security only keeps the scheme in the OpenAPI schema; AuthContextMiddleware did the decoding.
+    state = request.scope.get("state") or {}
+    user_id = state.get("auth_subject")
+    if not user_id:
+        error = state.get("auth_error")
+        if isinstance(error, ApiError):
+            raise error
+        raise ApiError(code="UNAUTHORIZED", message=error or "Authorization token is required", status_code=401)
+    return user_id
+
+
+def ensure_active_user(user: dict[str, Any] | None, status_field: str = "status") -> None:
     if not user or user.get("deleted_at") is not None:
         raise ApiError(code="UNAUTHORIZED", message="User does not exist", status_code=401)
 
-    if user.get("status") == "blocked":
+    if user.get(status_field) == "blocked":
         raise ApiError(code="FORBIDDEN", message="User is blocked", status_code=403)
 
-    return user
+
+async def current_user(user_id: str = Depends(token_user_id)) -> dict[str, Any]:
+    user = load_auth_user(user_id)
+    ensure_active_user(user)
+    return dict(user)
 
 
 async def admin_user(user: dict[str, Any] = Depends(current_user)) -> dict[str, Any]:
@@ -1451,6 +1897,26 @@ async def forward_error(response: httpx.Response) -> None:
     raise ApiError(code=code, message=message, status_code=502, details=details)
 
 
+def get_internal_http_client() -> httpx.AsyncClient:
+    global internal_http_client
+    if internal_http_client is None:
+        internal_http_client = httpx.AsyncClient(
+            timeout=120.0,
+            limits=httpx.Limits(
+                max_connections=int(os.getenv("INTERNAL_HTTP_MAX_CONNECTIONS", "200")),
+                max_keepalive_connections=int(os.getenv("INTERNAL_HTTP_MAX_KEEPALIVE", "100")),
+            ),
+        )
+    return internal_http_client
+
+
+async def close_internal_http_client() -> None:
+    global internal_http_client
+    if internal_http_client is not None:
+        await internal_http_client.aclose()
+        internal_http_client = None
+
+
 async def call_internal(
     method: str,
     url: str,
@@ -1460,19 +1926,18 @@ async def call_internal(
     files_payload: dict[str, Any] | None = None,
 ) -> httpx.Response:
     headers = {"X-Request-Id": request_id}
-    internal_token = os.getenv("INTERNAL_TOKEN", "").strip()
+    internal_token = get_settings().internal_token
     if internal_token:
         headers["X-Internal-Token"] = internal_token
 
-    async with httpx.AsyncClient(timeout=120.0) as client:
-        response = await client.request(
-            method=method,
-            url=url,
-            headers=headers,
-            json=json_payload,
-            data=data_payload,
-            files=files_payload,
-        )
+    response = await get_internal_http_client().request(
+        method=method,
+        url=url,
+        headers=headers,
+        json=json_payload,
+        data=data_payload,
+        files=files_payload,
+    )
 
     if response.status_code >= 400:
         await forward_error(response)
@@ -1480,6 +1945,76 @@ async def call_internal(
     return response
 
 
+def upload_error_response(limit: int, received: int | None) -> JSONResponse:
+    if received == 0:
+        return JSONResponse(
+            status_code=400,
+            content={"error": {"code": "EMPTY_FILE", "message": "Uploaded file is empty", "details": {}}},
+        )
+    return JSONResponse(
+        status_code=413,
+        content={"error": {"code": "FILE_TOO_LARGE", "message": "Uploaded file is too large", "details": {"max_bytes": limit}}},
+    )
+
+
+class UploadSizeLimitMiddleware:
+    """Rejects empty or oversized upload bodies before FastAPI parses the multipart form.
+
+    Content-Length is checked up front; bodies without one are counted as they stream in.
+    """
+
+    def __init__(self, app: Any, paths: frozenset[str]):
+        self.app = app
+        self.paths = paths
+
+    async def __call__(self, scope: dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        limit = get_settings().max_upload_bytes
+        content_length = next((value for name, value in scope["headers"] if name == b"content-length"), None)
+        if content_length is not None and content_length.isdigit():
+            declared = int(content_length)
+            if declared == 0 or declared > limit:
+                await upload_error_response(limit, declared)(scope, receive, send)
+                return
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def limited_receive() -> dict[str, Any]:
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Starlette turns the disconnect into a parse error; guarded_send swaps in the 413.
+                    exceeded = True
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message: dict[str, Any]) -> None:
+            nonlocal response_started
+            if exceeded:
+                return
+            response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not exceeded:
+                raise
+        if exceeded and not response_started:
+            await upload_error_response(limit, received)(scope, receive, send)
+
+
+app.add_middleware(AuthContextMiddleware)
+app.add_middleware(UploadSizeLimitMiddleware, paths=frozenset({"/api/v1/sources"}))
+
+
 @app.middleware("http")
 async def request_id_middleware(request: Request, call_next):
     request_id = request.headers.get("X-Request-Id", str(uuid.uuid4()))
@@ -1518,18 +2053,25 @@ def health() -> dict[str, str]:
     return {"status": "ok"}
 
 
+@lru_cache(maxsize=1)
+def pricing_payload_bytes() -> bytes:
+    return orjson.dumps(
+        {
+            "plans": [
+                {
+                    "plan": plan,
+                    "price": PLAN_PRICING[plan],
+                    "limits": PLAN_LIMITS[plan],
+                }
+                for plan in ["free", "pro", "team", "business"]
+            ]
+        }
+    )
+
+
 @app.get("/api/public/pricing")
-def public_pricing() -> dict[str, Any]:
-    return {
-        "plans": [
-            {
-                "plan": plan,
-                "price": PLAN_PRICING[plan],
-                "limits": PLAN_LIMITS[plan],
-            }
-            for plan in ["free", "pro", "team", "business"]
-        ]
-    }
+def public_pricing() -> Response:
+    return Response(content=pricing_payload_bytes(), media_type="application/json")
 
 
 @app.get("/api/public/examples")
@@ -1594,17 +2136,11 @@ def auth_signup(payload: SignupRequest, request: Request, response: Response) ->
 
 @app.post("/api/auth/login")
 def auth_login(payload: LoginRequest, request: Request, response: Response) -> dict[str, Any]:
-    rate_key = request.client.host if request.client else payload.email
+    email = normalize_login_email(payload.email)
+    rate_key = request.client.host if request.client else email
     enforce_rate_limit("auth.login", str(rate_key), limit=30, window_seconds=60)
 
-    user = db_fetchone(
-        """
-        SELECT id, email, name, role, plan, status, password_hash, deleted_at
-        FROM users
-        WHERE email = %s
-        """,
-        (payload.email,),
-    )
+    user = db_fetchone(SQL_LOGIN_USER, (email,))
 
     if not user or user.get("deleted_at") is not None or not password_context.verify(payload.password, user.get("password_hash") or ""):
         raise ApiError(code="INVALID_CREDENTIALS", message="Email or password is incorrect", status_code=401)
@@ -1613,6 +2149,7 @@ def auth_login(payload: LoginRequest, request: Request, response: Response) -> d
         raise ApiError(code="FORBIDDEN", message="User is blocked", status_code=403)
 
     db_execute("UPDATE users SET last_login_at = NOW() WHERE id = %s", (user["id"],))
+    invalidate_auth_user(user["id"])
     ensure_personal_workspace(str(user["id"]), str(user.get("name") or "User"))
     return issue_auth_payload(response, user)
 
@@ -1722,6 +2259,7 @@ def patch_me(payload: MePatchRequest, user: dict[str, Any] = Depends(current_use
         """,
         (payload.name, user["id"]),
     )
+    invalidate_auth_user(user["id"])
     if not row:
         raise ApiError(code="NOT_FOUND", message="User not found", status_code=404)
     return serialize_user(row)
@@ -1744,6 +2282,7 @@ def me_delete(response: Response, user: dict[str, Any] = Depends(current_user),
         """,
         (user["id"],),
     )
+    invalidate_auth_user(user["id"])
     db_execute("UPDATE refresh_tokens SET revoked_at = NOW() WHERE user_id = %s AND revoked_at IS NULL", (user["id"],))
     if refresh_token:
         revoke_refresh_token(refresh_token)
@@ -2511,18 +3050,7 @@ def build_run(
 
 @app.get("/api/builds/{build_id}")
 def get_build(build_id: str, user: dict[str, Any] = Depends(current_user)) -> dict[str, Any]:
-    row = db_fetchone(
-        """
-        SELECT cb.*
-        FROM course_builds cb
-        JOIN courses c ON c.id = cb.course_id
-        LEFT JOIN workspaces w ON w.id = c.workspace_id
-        LEFT JOIN workspace_members wm ON wm.workspace_id = c.workspace_id AND wm.user_id = %s
-        WHERE cb.id = %s
-          AND (c.owner_user_id = %s OR wm.user_id IS NOT NULL OR %s = 'admin')
-        """,
-        (user["id"], build_id, user["id"], user.get("role", "user")),
-    )
+    row = db_fetchone(SQL_BUILD_DETAILS, (user["id"], build_id, user["id"], user.get("role", "user")))
     if not row:
         raise ApiError(code="NOT_FOUND", message="Build not found", status_code=404)
 
@@ -2759,25 +3287,7 @@ def submit_practice_attempt(
 def get_course_progress(course_id: str, user: dict[str, Any] = Depends(current_user)) -> dict[str, Any]:
     get_course_access(course_id, user)
     state = ensure_user_course_state(str(user["id"]), course_id)
-
-    completed_lessons = json_load(state.get("completed_lessons"), [])
-    total_row = db_fetchone("SELECT COUNT(*)::int AS total FROM lessons WHERE course_id = %s", (course_id,))
-    total = int((total_row or {}).get("total") or 0)
-    percent = round((len(completed_lessons) / total) * 100, 2) if total > 0 else 0
-
-    return {
-        "current_lesson_id": str(state["current_lesson_id"]) if state.get("current_lesson_id") else None,
-        "completed_lessons": completed_lessons,
-        "quiz_attempts": json_load(state.get("quiz_attempts"), []),
-        "streak_days": int(state.get("streak_days") or 0),
-        "last_activity_at": state.get("last_activity_at"),
-        "aggregate": {
-            "percent": percent,
-            "completed_lessons": len(completed_lessons),
-            "total_lessons": total,
-            "streak": int(state.get("streak_days") or 0),
-        },
-    }
+    return build_progress_response(state, count_course_lessons(course_id))
 
 
 @app.post("/api/courses/{course_id}/progress/complete-lesson")
@@ -2808,7 +3318,7 @@ def complete_lesson(course_id: str, payload: ProgressLessonRequest, user: dict[s
     else:
         streak = 1
 
-    db_execute(
+    updated_state = db_fetchone(
         """
         UPDATE user_course_states
         SET completed_lessons = %s::jsonb,
@@ -2816,12 +3326,14 @@ def complete_lesson(course_id: str, payload: ProgressLessonRequest, user: dict[s
             last_activity_at = NOW(),
             updated_at = NOW()
         WHERE id = %s
+        RETURNING *
         """,
         (json_dumps(completed), streak, state["id"]),
     )
+    if not updated_state:
+        raise ApiError(code="STATE_UPDATE_FAILED", message="Could not update course state", status_code=500)
 
-    total_row = db_fetchone("SELECT COUNT(*)::int AS total FROM lessons WHERE course_id = %s", (course_id,))
-    total = int((total_row or {}).get("total") or 0)
+    total = count_course_lessons(course_id)
     percent = round((len(completed) / total) * 100, 2) if total > 0 else 0
 
     db_execute(
@@ -2844,7 +3356,7 @@ def complete_lesson(course_id: str, payload: ProgressLessonRequest, user: dict[s
         ),
     )
 
-    return get_course_progress(course_id, user)
+    return build_progress_response(updated_state, total)
 
 
 @app.post("/api/courses/{course_id}/progress/set-current")
@@ -2857,17 +3369,20 @@ def set_current_lesson(course_id: str, payload: ProgressLessonRequest, user: dic
         raise ApiError(code="NOT_FOUND", message="Lesson not found", status_code=404)
 
     state = ensure_user_course_state(str(user["id"]), course_id)
-    db_execute(
+    updated_state = db_fetchone(
         """
         UPDATE user_course_states
         SET current_lesson_id = %s,
             last_activity_at = NOW(),
             updated_at = NOW()
         WHERE id = %s
+        RETURNING *
         """,
         (lesson_id, state["id"]),
     )
-    return get_course_progress(course_id, user)
+    if not updated_state:
+        raise ApiError(code="STATE_UPDATE_FAILED", message="Could not update course state", status_code=500)
+    return build_progress_response(updated_state, count_course_lessons(course_id))
 
 
 @app.post("/api/courses/{course_id}/share-link")
@@ -2875,28 +3390,27 @@ def create_share_link(course_id: str, payload: ShareCreateRequest, user: dict[st
     get_course_access(course_id, user, write=True)
     share_id = str(uuid.uuid4())
 
-    existing = db_fetchone("SELECT id FROM course_share_links WHERE course_id = %s", (course_id,))
-    if existing:
-        db_execute(
-            """
-            UPDATE course_share_links
-            SET id = %s,
-                expires_at = %s,
-                revoked_at = NULL
-            WHERE course_id = %s
-            """,
-            (share_id, payload.expires_at, course_id),
-        )
-    else:
-        db_execute(
-            """
-            INSERT INTO course_share_links (id, course_id, expires_at)
-            VALUES (%s, %s, %s)
-            """,
-            (share_id, course_id, payload.expires_at),
+    row = db_fetchone(
+        """
+        WITH share AS (
+          INSERT INTO course_share_links (id, course_id, expires_at)
+          VALUES (%s, %s, %s)
+          ON CONFLICT (course_id)
+          DO UPDATE SET id = EXCLUDED.id,
+                        expires_at = EXCLUDED.expires_at,
+                        revoked_at = NULL
+          RETURNING id
         )
-
-    db_execute("UPDATE courses SET visibility = 'shared_link', updated_at = NOW() WHERE id = %s", (course_id,))
+        UPDATE courses
+        SET visibility = 'shared_link',
+            updated_at = NOW()
+        WHERE id = %s
+        RETURNING (SELECT id FROM share) AS share_id
+        """,
+        (share_id, course_id, payload.expires_at, course_id),
+    )
+    if not row:
+        raise ApiError(code="NOT_FOUND", message="Course not found", status_code=404)
 
     base = os.getenv("PUBLIC_SHARE_BASE_URL", "http://localhost:8000/api/share")
     return {
@@ -2923,10 +3437,17 @@ def delete_share_link(course_id: str, user: dict[str, Any] = Depends(current_use
 
 
 @app.get("/api/share/{share_id}")
-def public_share(share_id: str) -> dict[str, Any]:
+def public_share(share_id: str) -> Response:
     row = db_fetchone(
         """
-        SELECT c.id, c.title, c.description, c.goal, c.level, c.format, c.outline_json
+        SELECT
+          c.id,
+          c.title,
+          c.description,
+          c.goal,
+          c.level,
+          c.format,
+          COALESCE(c.outline_json, '{"modules": []}'::jsonb)::text AS outline_json
         FROM course_share_links sl
         JOIN courses c ON c.id = sl.course_id
         WHERE sl.id::text = %s
@@ -2939,15 +3460,18 @@ def public_share(share_id: str) -> dict[str, Any]:
     if not row:
         raise ApiError(code="NOT_FOUND", message="Share link not found", status_code=404)
 
-    return {
-        "id": str(row["id"]),
-        "title": row["title"],
-        "description": row["description"],
-        "goal": row["goal"],
-        "level": row["level"],
-        "format": row["format"],
-        "outline": json_load(row.get("outline_json"), {"modules": []}),
-    }
+    head = orjson.dumps(
+        {
+            "id": str(row["id"]),
+            "title": row["title"],
+            "description": row["description"],
+            "goal": row["goal"],
+            "level": row["level"],
+            "format": row["format"],
+        }
+    )
+    outline = row["outline_json"].encode("utf-8")
+    return Response(content=head[:-1] + b',"outline":' + outline + b"}", media_type="application/json")
 
 
 @app.post("/api/feedback", status_code=201)
@@ -2971,37 +3495,31 @@ def create_feedback(payload: FeedbackCreateRequest, user: dict[str, Any] = Depen
 
 
 @app.get("/api/feedback")
-def list_feedback_admin(user: dict[str, Any] = Depends(admin_user)) -> dict[str, Any]:
+def list_feedback_admin(user: dict[str, Any] = Depends(admin_user)) -> ORJSONResponse:
     rows = db_fetchall(
         """
-        SELECT id, user_id, course_id, lesson_id, type, message, meta, status, created_at, updated_at
+        SELECT
+          id::text AS id,
+          user_id::text AS user_id,
+          course_id::text AS course_id,
+          lesson_id::text AS lesson_id,
+          type,
+          message,
+          COALESCE(meta, '{}'::jsonb)::text AS meta,
+          status,
+          created_at,
+          updated_at
         FROM feedback_reports
         ORDER BY created_at DESC
         LIMIT 200
         """
     )
-    return {
-        "items": [
-            {
-                "id": str(row["id"]),
-                "user_id": str(row["user_id"]) if row.get("user_id") else None,
-                "course_id": str(row["course_id"]) if row.get("course_id") else None,
-                "lesson_id": str(row["lesson_id"]) if row.get("lesson_id") else None,
-                "type": row["type"],
-                "message": row["message"],
-                "meta": json_load(row.get("meta"), {}),
-                "status": row["status"],
-                "created_at": row["created_at"],
-                "updated_at": row["updated_at"],
-            }
-            for row in rows
-        ]
-    }
+    return ORJSONResponse({"items": [serialize_feedback(row) for row in rows]})
 
 
 @app.get("/api/billing/plans")
-def billing_plans() -> dict[str, Any]:
-    return public_pricing()
+def billing_plans() -> Response:
+    return Response(content=pricing_payload_bytes(), media_type="application/json")
 
 
 @app.post("/api/billing/checkout")
@@ -3025,6 +3543,7 @@ def billing_checkout(payload: BillingCheckoutRequest, user: dict[str, Any] = Dep
         raise ApiError(code="BILLING_FAILED", message="Could not create checkout session", status_code=500)
 
     db_execute("UPDATE users SET plan = %s, updated_at = NOW() WHERE id = %s", (payload.plan, user["id"]))
+    invalidate_auth_user(user["id"])
     return {
         "checkout_url": f"https://billing.example/checkout/{row['id']}",
         "subscription_id": str(row["id"]),
@@ -3032,7 +3551,7 @@ def billing_checkout(payload: BillingCheckoutRequest, user: dict[str, Any] = Dep
 
 
 @app.get("/api/billing/subscription")
-def billing_subscription(user: dict[str, Any] = Depends(current_user)) -> dict[str, Any]:
+def billing_subscription(user: dict[str, Any] = Depends(current_user)) -> ORJSONResponse:
     row = db_fetchone(
         """
         SELECT id, workspace_id, user_id, provider, plan, status, current_period_end, provider_payload, created_at, updated_at
@@ -3044,23 +3563,27 @@ def billing_subscription(user: dict[str, Any] = Depends(current_user)) -> dict[s
         (user["id"],),
     )
     if not row:
-        return {
-            "plan": user.get("plan") or "free",
-            "status": "none",
-        }
+        return ORJSONResponse(
+            {
+                "plan": user.get("plan") or "free",
+                "status": "none",
+            }
+        )
 
-    return {
-        "id": str(row["id"]),
-        "workspace_id": str(row["workspace_id"]) if row.get("workspace_id") else None,
-        "user_id": str(row["user_id"]) if row.get("user_id") else None,
-        "provider": row["provider"],
-        "plan": row["plan"],
-        "status": row["status"],
-        "current_period_end": row["current_period_end"],
-        "provider_payload": json_load(row.get("provider_payload"), {}),
-        "created_at": row["created_at"],
-        "updated_at": row["updated_at"],
-    }
+    return ORJSONResponse(
+        {
+            "id": str(row["id"]),
+            "workspace_id": str(row["workspace_id"]) if row.get("workspace_id") else None,
+            "user_id": str(row["user_id"]) if row.get("user_id") else None,
+            "provider": row["provider"],
+            "plan": row["plan"],
+            "status": row["status"],
+            "current_period_end": row["current_period_end"],
+            "provider_payload": json_load(row.get("provider_payload"), {}),
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+        }
+    )
 
 
 @app.post("/api/billing/portal")
@@ -3091,13 +3614,7 @@ def billing_webhook(payload: dict[str, Any]) -> dict[str, Any]:
         amount = payload.get("amount") or 0
         currency = payload.get("currency") or "USD"
         status = payload.get("status") or "succeeded"
-        db_execute(
-            """
-            INSERT INTO payments (subscription_id, amount, currency, status, provider_payload)
-            VALUES (%s, %s, %s, %s, %s::jsonb)
-            """,
-            (sub_id, amount, currency, status, json_dumps(payload)),
-        )
+        record_payment((sub_id, amount, currency, status, json_dumps(payload)))
 
     return {"status": "ok"}
 
@@ -3109,39 +3626,36 @@ def admin_list_users(
     plan: str | None = Query(default=None),
     page: int = Query(default=1, ge=1),
     page_size: int = Query(default=20, ge=1, le=100),
+    cursor: str | None = Query(default=None),
     user: dict[str, Any] = Depends(admin_user),
 ) -> dict[str, Any]:
-    offset = (page - 1) * page_size
-    conditions = ["deleted_at IS NULL"]
     params: list[Any] = []
-
     if q:
-        conditions.append("(email ILIKE %s OR name ILIKE %s)")
         params.extend([f"%{q}%", f"%{q}%"])
     if status:
-        conditions.append("status = %s")
         params.append(status)
     if plan:
-        conditions.append("plan = %s")
         params.append(plan)
-
-    params.extend([page_size, offset])
+    if cursor:
+        params.extend(decode_page_cursor(cursor))
+        params.append(page_size)
+    else:
+        params.extend([page_size, (page - 1) * page_size])
 
     rows = db_fetchall(
-        f"""
-        SELECT id, email, name, role, plan, status, created_at, last_login_at
-        FROM users
-        WHERE {' AND '.join(conditions)}
-        ORDER BY created_at DESC
-        LIMIT %s OFFSET %s
-        """,
+        build_admin_users_sql(bool(q), bool(status), bool(plan), bool(cursor)),
         tuple(params),
     )
 
+    next_cursor = None
+    if len(rows) == page_size:
+        next_cursor = encode_page_cursor(rows[-1]["created_at"], rows[-1]["id"])
+
     return {
         "items": [serialize_user(row) for row in rows],
         "page": page,
         "page_size": page_size,
+        "next_cursor": next_cursor,
     }
 
 
@@ -3163,32 +3677,34 @@ def admin_get_user(user_id: str, user: dict[str, Any] = Depends(admin_user)) ->
 
 @app.patch("/api/admin/users/{user_id}")
 def admin_patch_user(user_id: str, payload: AdminUserPatchRequest, user: dict[str, Any] = Depends(admin_user)) -> dict[str, Any]:
-    fields: list[str] = []
-    params: list[Any] = []
-    if payload.status is not None:
-        fields.append("status = %s")
-        params.append(payload.status)
     if payload.plan is not None:
         validate_plan(payload.plan)
-        fields.append("plan = %s")
-        params.append(payload.plan)
-
-    if not fields:
-        return admin_get_user(user_id, user)
-
-    fields.append("updated_at = NOW()")
-    params.append(user_id)
+    has_changes = payload.status is not None or payload.plan is not None
 
     row = db_fetchone(
-        f"""
-        UPDATE users
-        SET {', '.join(fields)}
+        """
+        WITH updated AS (
+          UPDATE users
+          SET status = COALESCE(%s, status),
+              plan = COALESCE(%s, plan),
+              updated_at = NOW()
+          WHERE id = %s
+            AND deleted_at IS NULL
+            AND %s::boolean
+          RETURNING id, email, name, role, plan, status, created_at, last_login_at
+        )
+        SELECT * FROM updated
+        UNION ALL
+        SELECT id, email, name, role, plan, status, created_at, last_login_at
+        FROM users
         WHERE id = %s
           AND deleted_at IS NULL
-        RETURNING id, email, name, role, plan, status, created_at, last_login_at
+          AND NOT EXISTS (SELECT 1 FROM updated)
         """,
-        tuple(params),
+        (payload.status, payload.plan, user_id, has_changes, user_id),
     )
+    if has_changes:
+        invalidate_auth_user(user_id)
     if not row:
         raise ApiError(code="NOT_FOUND", message="User not found", status_code=404)
     return serialize_user(row)
@@ -3211,8 +3727,9 @@ def admin_impersonate(user_id: str, user: dict[str, Any] = Depends(admin_user))
     if target.get("status") != "active":
         raise ApiError(code="FORBIDDEN", message="Cannot impersonate non-active user", status_code=403)
 
-    token = create_access_token(
-        user_id=str(target["id"]),
+    token = issue_impersonation_token(
+        admin_id=str(user["id"]),
+        target_id=str(target["id"]),
         email=str(target["email"]),
         role=str(target.get("role") or "user"),
         plan=str(target.get("plan") or "free"),
@@ -3230,43 +3747,65 @@ def admin_list_courses(
     status: str | None = Query(default=None),
     page: int = Query(default=1, ge=1),
     page_size: int = Query(default=20, ge=1, le=100),
+    cursor: str | None = Query(default=None),
     user: dict[str, Any] = Depends(admin_user),
 ) -> dict[str, Any]:
-    offset = (page - 1) * page_size
-    conditions = ["c.deleted_at IS NULL"]
     params: list[Any] = []
     if q:
-        conditions.append("(c.title ILIKE %s OR c.goal ILIKE %s)")
         params.extend([f"%{q}%", f"%{q}%"])
     if status:
-        conditions.append("c.status = %s")
         params.append(status)
-    params.extend([page_size, offset])
+    if cursor:
+        params.extend(decode_page_cursor(cursor))
+        params.append(page_size)
+    else:
+        params.extend([page_size, (page - 1) * page_size])
 
     rows = db_fetchall(
-        f"""
-        SELECT c.*
-        FROM courses c
-        WHERE {' AND '.join(conditions)}
-        ORDER BY c.updated_at DESC
-        LIMIT %s OFFSET %s
-        """,
+        build_admin_courses_sql(bool(q), bool(status), bool(cursor)),
         tuple(params),
     )
 
+    next_cursor = None
+    if len(rows) == page_size:
+        next_cursor = encode_page_cursor(rows[-1]["updated_at"], rows[-1]["id"])
+
     return {
         "items": [serialize_course(row) for row in rows],
         "page": page,
         "page_size": page_size,
+        "next_cursor": next_cursor,
     }
 
 
 @app.get("/api/admin/courses/{course_id}")
-def admin_get_course(course_id: str, user: dict[str, Any] = Depends(admin_user)) -> dict[str, Any]:
-    row = db_fetchone("SELECT * FROM courses WHERE id = %s AND deleted_at IS NULL", (course_id,))
+def admin_get_course(course_id: str, user: dict[str, Any] = Depends(admin_user)) -> ORJSONResponse:
+    row = db_fetchone(
+        """
+        SELECT
+          c.id,
+          c.workspace_id,
+          c.owner_user_id,
+          c.title,
+          c.description,
+          c.goal,
+          c.level,
+          c.format,
+          c.pace_minutes_per_day,
+          c.status,
+          c.visibility,
+          c.progress_json,
+          c.created_at,
+          c.updated_at
+        FROM courses c
+        WHERE c.id = %s
+          AND c.deleted_at IS NULL
+        """,
+        (course_id,),
+    )
     if not row:
         raise ApiError(code="NOT_FOUND", message="Course not found", status_code=404)
-    return serialize_course(row)
+    return ORJSONResponse(serialize_course(row))
 
 
 @app.post("/api/admin/courses/{course_id}/rebuild")
@@ -3308,20 +3847,7 @@ def admin_list_templates(user: dict[str, Any] = Depends(admin_user)) -> dict[str
         ORDER BY created_at DESC
         """
     )
-    return {
-        "items": [
-            {
-                "id": str(row["id"]),
-                "name": row["name"],
-                "description": row["description"],
-                "schema": json_load(row.get("schema"), {}),
-                "is_active": row["is_active"],
-                "created_at": row["created_at"],
-                "updated_at": row["updated_at"],
-            }
-            for row in rows
-        ]
-    }
+    return {"items": [serialize_template(row) for row in rows]}
 
 
 @app.post("/api/admin/templates", status_code=201)
@@ -3337,15 +3863,7 @@ def admin_create_template(payload: TemplateCreateRequest, user: dict[str, Any] =
     if not row:
         raise ApiError(code="TEMPLATE_CREATE_FAILED", message="Could not create template", status_code=500)
 
-    return {
-        "id": str(row["id"]),
-        "name": row["name"],
-        "description": row["description"],
-        "schema": json_load(row.get("schema"), {}),
-        "is_active": row["is_active"],
-        "created_at": row["created_at"],
-        "updated_at": row["updated_at"],
-    }
+    return serialize_template(row)
 
 
 @app.patch("/api/admin/templates/{template_id}")
@@ -3354,55 +3872,32 @@ def admin_patch_template(
     payload: TemplatePatchRequest,
     user: dict[str, Any] = Depends(admin_user),
 ) -> dict[str, Any]:
-    fields: list[str] = []
-    params: list[Any] = []
-
-    if payload.name is not None:
-        fields.append("name = %s")
-        params.append(payload.name)
-    if payload.description is not None:
-        fields.append("description = %s")
-        params.append(payload.description)
-    if payload.template_schema is not None:
-        fields.append("schema = %s::jsonb")
-        params.append(json_dumps(payload.template_schema))
-
-    if not fields:
-        template = db_fetchone("SELECT id, name, description, schema, is_active, created_at, updated_at FROM templates WHERE id = %s", (template_id,))
-        if not template:
-            raise ApiError(code="NOT_FOUND", message="Template not found", status_code=404)
-        return {
-            "id": str(template["id"]),
-            "name": template["name"],
-            "description": template["description"],
-            "schema": json_load(template.get("schema"), {}),
-            "is_active": template["is_active"],
-            "created_at": template["created_at"],
-            "updated_at": template["updated_at"],
-        }
-
-    fields.append("updated_at = NOW()")
-    params.append(template_id)
+    has_changes = any(value is not None for value in (payload.name, payload.description, payload.template_schema))
+    schema = json_dumps(payload.template_schema) if payload.template_schema is not None else None
     row = db_fetchone(
-        f"""
-        UPDATE templates
-        SET {', '.join(fields)}
+        """
+        WITH updated AS (
+          UPDATE templates
+          SET name = COALESCE(%s, name),
+              description = COALESCE(%s, description),
+              schema = COALESCE(%s::jsonb, schema),
+              updated_at = NOW()
+          WHERE id = %s
+            AND %s::boolean
+          RETURNING id, name, description, schema, is_active, created_at, updated_at
+        )
+        SELECT * FROM updated
+        UNION ALL
+        SELECT id, name, description, schema, is_active, created_at, updated_at
+        FROM templates
         WHERE id = %s
-        RETURNING id, name, description, schema, is_active, created_at, updated_at
+          AND NOT EXISTS (SELECT 1 FROM updated)
         """,
-        tuple(params),
+        (payload.name, payload.description, schema, template_id, has_changes, template_id),
     )
     if not row:
         raise ApiError(code="NOT_FOUND", message="Template not found", status_code=404)
-    return {
-        "id": str(row["id"]),
-        "name": row["name"],
-        "description": row["description"],
-        "schema": json_load(row.get("schema"), {}),
-        "is_active": row["is_active"],
-        "created_at": row["created_at"],
-        "updated_at": row["updated_at"],
-    }
+    return serialize_template(row)
 
 
 @app.post("/api/admin/templates/{template_id}/activate")
@@ -3443,7 +3938,17 @@ def admin_deactivate_template(template_id: str, user: dict[str, Any] = Depends(a
 def admin_billing_subscriptions(user: dict[str, Any] = Depends(admin_user)) -> dict[str, Any]:
     rows = db_fetchall(
         """
-        SELECT id, workspace_id, user_id, provider, plan, status, current_period_end, provider_payload, created_at, updated_at
+        SELECT
+          id::text AS id,
+          workspace_id::text AS workspace_id,
+          user_id::text AS user_id,
+          provider,
+          plan,
+          status,
+          current_period_end,
+          provider_payload,
+          created_at,
+          updated_at
         FROM subscriptions
         ORDER BY created_at DESC
         LIMIT 500
@@ -3452,9 +3957,9 @@ def admin_billing_subscriptions(user: dict[str, Any] = Depends(admin_user)) -> d
     return {
         "items": [
             {
-                "id": str(row["id"]),
-                "workspace_id": str(row["workspace_id"]) if row.get("workspace_id") else None,
-                "user_id": str(row["user_id"]) if row.get("user_id") else None,
+                "id": row["id"],
+                "workspace_id": row["workspace_id"],
+                "user_id": row["user_id"],
                 "provider": row["provider"],
                 "plan": row["plan"],
                 "status": row["status"],
@@ -3472,7 +3977,7 @@ def admin_billing_subscriptions(user: dict[str, Any] = Depends(admin_user)) -> d
 def admin_billing_payments(user: dict[str, Any] = Depends(admin_user)) -> dict[str, Any]:
     rows = db_fetchall(
         """
-        SELECT id, subscription_id, amount, currency, status, provider_payload, created_at
+        SELECT id::text AS id, subscription_id::text AS subscription_id, amount, currency, status, provider_payload, created_at
         FROM payments
         ORDER BY created_at DESC
         LIMIT 500
@@ -3481,8 +3986,8 @@ def admin_billing_payments(user: dict[str, Any] = Depends(admin_user)) -> dict[s
     return {
         "items": [
             {
-                "id": str(row["id"]),
-                "subscription_id": str(row["subscription_id"]) if row.get("subscription_id") else None,
+                "id": row["id"],
+                "subscription_id": row["subscription_id"],
                 "amount": float(row["amount"]),
                 "currency": row["currency"],
                 "status": row["status"],
@@ -3499,43 +4004,16 @@ def admin_list_feedback(
     status: str | None = Query(default=None),
     type: str | None = Query(default=None),
     user: dict[str, Any] = Depends(admin_user),
-) -> dict[str, Any]:
-    conditions = ["1=1"]
+) -> ORJSONResponse:
     params: list[Any] = []
     if status:
-        conditions.append("status = %s")
         params.append(status)
     if type:
-        conditions.append("type = %s")
         params.append(type)
 
-    rows = db_fetchall(
-        f"""
-        SELECT id, user_id, course_id, lesson_id, type, message, meta, status, created_at, updated_at
-        FROM feedback_reports
-        WHERE {' AND '.join(conditions)}
-        ORDER BY created_at DESC
-        """,
-        tuple(params),
-    )
+    rows = db_fetchall(build_admin_feedback_sql(bool(status), bool(type)), tuple(params))
 
-    return {
-        "items": [
-            {
-                "id": str(row["id"]),
-                "user_id": str(row["user_id"]) if row.get("user_id") else None,
-                "course_id": str(row["course_id"]) if row.get("course_id") else None,
-                "lesson_id": str(row["lesson_id"]) if row.get("lesson_id") else None,
-                "type": row["type"],
-                "message": row["message"],
-                "meta": json_load(row.get("meta"), {}),
-                "status": row["status"],
-                "created_at": row["created_at"],
-                "updated_at": row["updated_at"],
-            }
-            for row in rows
-        ]
-    }
+    return ORJSONResponse({"items": [serialize_feedback(row) for row in rows]})
 
 
 @app.patch("/api/admin/feedback/{feedback_id}")
@@ -3565,35 +4043,34 @@ def admin_patch_feedback(
 
 @app.get("/api/admin/health")
 def admin_health(user: dict[str, Any] = Depends(admin_user)) -> dict[str, Any]:
-    failed_builds = db_fetchone(
-        """
-        SELECT COUNT(*)::int AS total
-        FROM course_builds
-        WHERE status = 'failed'
-          AND created_at >= NOW() - INTERVAL '24 hours'
+    counts = db_fetchone(
         """
-    )
-    running_builds = db_fetchone(
-        """
-        SELECT COUNT(*)::int AS total
-        FROM course_builds
-        WHERE status IN ('queued', 'running')
-        """
-    )
-    failed_jobs = db_fetchone(
-        """
-        SELECT COUNT(*)::int AS total
-        FROM jobs
-        WHERE status = 'failed'
-          AND created_at >= NOW() - INTERVAL '24 hours'
+        SELECT
+          (
+            SELECT COUNT(*)::int
+            FROM course_builds
+            WHERE status = 'failed'
+              AND created_at >= NOW() - INTERVAL '24 hours'
+          ) AS failed_builds,
+          (
+            SELECT COUNT(*)::int
+            FROM course_builds
+            WHERE status IN ('queued', 'running')
+          ) AS running_builds,
+          (
+            SELECT COUNT(*)::int
+            FROM jobs
+            WHERE status = 'failed'
+              AND created_at >= NOW() - INTERVAL '24 hours'
+          ) AS failed_jobs
         """
-    )
+    ) or {}
 
     return {
         "uptime_seconds": int((now_utc() - started_at).total_seconds()),
-        "builds_running": int((running_builds or {}).get("total") or 0),
-        "builds_failed_24h": int((failed_builds or {}).get("total") or 0),
-        "legacy_jobs_failed_24h": int((failed_jobs or {}).get("total") or 0),
+        "builds_running": int(counts.get("running_builds") or 0),
+        "builds_failed_24h": int(counts.get("failed_builds") or 0),
+        "legacy_jobs_failed_24h": int(counts.get("failed_jobs") or 0),
         "status": "ok",
     }
 
@@ -3602,7 +4079,7 @@ def admin_health(user: dict[str, Any] = Depends(admin_user)) -> dict[str, Any]:
 def admin_jobs(user: dict[str, Any] = Depends(admin_user)) -> dict[str, Any]:
     builds = db_fetchall(
         """
-        SELECT id, course_id, step, status, progress_pct, error_message, created_at, updated_at
+        SELECT id::text AS id, course_id::text AS course_id, step, status, progress_pct, error_message, created_at, updated_at
         FROM course_builds
         ORDER BY created_at DESC
         LIMIT 100
@@ -3611,7 +4088,7 @@ def admin_jobs(user: dict[str, Any] = Depends(admin_user)) -> dict[str, Any]:
 
     legacy_jobs = db_fetchall(
         """
-        SELECT id, source_id, status, error, created_at, updated_at
+        SELECT id::text AS id, source_id::text AS source_id, status, error, created_at, updated_at
         FROM jobs
         ORDER BY created_at DESC
         LIMIT 100
@@ -3621,8 +4098,8 @@ def admin_jobs(user: dict[str, Any] = Depends(admin_user)) -> dict[str, Any]:
     return {
         "builds": [
             {
-                "id": str(row["id"]),
-                "course_id": str(row["course_id"]),
+                "id": row["id"],
+                "course_id": row["course_id"],
                 "step": row["step"],
                 "status": row["status"],
                 "progress_pct": row["progress_pct"],
@@ -3634,8 +4111,8 @@ def admin_jobs(user: dict[str, Any] = Depends(admin_user)) -> dict[str, Any]:
         ],
         "legacy_jobs": [
             {
-                "id": str(row["id"]),
-                "source_id": str(row["source_id"]),
+                "id": row["id"],
+                "source_id": row["source_id"],
                 "status": row["status"],
                 "error": row.get("error"),
                 "created_at": row["created_at"],
@@ -3661,14 +4138,7 @@ def register_v1(payload: RegisterRequest) -> dict[str, Any]:
 
 @app.post("/api/v1/auth/login")
 def login_v1(payload: LoginRequest) -> dict[str, Any]:
-    user = db_fetchone(
-        """
-        SELECT id, email, role, plan, password_hash, deleted_at, status
-        FROM users
-        WHERE email = %s
-        """,
-        (payload.email,),
-    )
+    user = db_fetchone(SQL_LOGIN_USER, (normalize_login_email(payload.email),))
 
     if not user or user.get("deleted_at") is not None or not password_context.verify(payload.password, user.get("password_hash") or ""):
         raise ApiError(code="INVALID_CREDENTIALS", message="Email or password is incorrect", status_code=401)
@@ -3687,18 +4157,19 @@ async def upload_source_v1(
     file: UploadFile = File(...),
     source_type: str = Form(default="document", alias="type"),
 ) -> dict[str, Any]:
-    file_bytes = await file.read()
-    if not file_bytes:
+    file.file.seek(0, os.SEEK_END)
+    if file.file.tell() == 0:
         raise ApiError(code="EMPTY_FILE", message="Uploaded file is empty", status_code=400)
+    file.file.seek(0)
 
     source_id = str(uuid.uuid4())
-    ingestion_url = os.getenv("INGESTION_URL", "http://ingestion-java:8080")
+    ingestion_url = get_settings().ingestion_url
     response = await call_internal(
         method="POST",
         url=f"{ingestion_url}/ingest",
         request_id=getattr(request.state, "request_id", str(uuid.uuid4())),
         data_payload={"sourceId": source_id, "userId": user["id"], "sourceType": source_type},
-        files_payload={"file": (file.filename or "document", file_bytes, file.content_type or "application/octet-stream")},
+        files_payload={"file": (file.filename or "document", file.file, file.content_type or "application/octet-stream")},
     )
 
     data = response.json()
@@ -3710,27 +4181,24 @@ async def upload_source_v1(
 
 
 @app.get("/api/v1/sources/{source_id}")
-def source_details_v1(source_id: str, user: dict[str, Any] = Depends(current_user)) -> dict[str, Any]:
-    row = db_fetchone(
-        """
-        SELECT s.id, s.type, s.name, s.status, j.id AS job_id, j.status AS job_status, j.error
-        FROM sources s
-        LEFT JOIN LATERAL (
-            SELECT id, status, error
-            FROM jobs
-            WHERE source_id = s.id
-            ORDER BY created_at DESC
-            LIMIT 1
-        ) j ON TRUE
-        WHERE s.id = %s
-          AND (s.user_id = %s OR s.user_id IS NULL)
-        """,
-        (source_id, user["id"]),
-    )
+def source_details_v1(
+    source_id: str,
+    request: Request,
+    response: Response,
+    user_id: str = Depends(token_user_id),
+) -> Any:
+    row = db_fetchone(SQL_SOURCE_DETAILS, (source_id, user_id))
 
-    if not row:
+    ensure_active_user(row, status_field="user_status")
+    if not row.get("id"):
         raise ApiError(code="SOURCE_NOT_FOUND", message="Source not found", status_code=404)
 
+    etag = weak_etag(row["updated_at"], row.get("job_updated_at"))
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+
     job = None
     if row.get("job_id"):
         job = {
@@ -3754,7 +4222,7 @@ async def create_course_v1(
     request: Request,
     user: dict[str, Any] = Depends(current_user),
 ) -> dict[str, Any]:
-    builder_url = os.getenv("COURSE_BUILDER_URL", "http://course-builder:8000")
+    builder_url = get_settings().course_builder_url
     response = await call_internal(
         method="POST",
         url=f"{builder_url}/build",
@@ -3777,20 +4245,24 @@ async def create_course_v1(
 
 
 @app.get("/api/v1/courses/{course_id}")
-def course_details_v1(course_id: str, user: dict[str, Any] = Depends(current_user)) -> dict[str, Any]:
-    row = db_fetchone(
-        """
-        SELECT id, title, goal, level, structure_json
-        FROM courses
-        WHERE id = %s
-          AND (user_id = %s OR user_id IS NULL)
-        """,
-        (course_id, user["id"]),
-    )
+def course_details_v1(
+    course_id: str,
+    request: Request,
+    response: Response,
+    user_id: str = Depends(token_user_id),
+) -> Any:
+    row = db_fetchone(SQL_COURSE_DETAILS, (course_id, user_id))
 
-    if not row:
+    ensure_active_user(row, status_field="user_status")
+    if not row.get("id"):
         raise ApiError(code="COURSE_NOT_FOUND", message="Course not found", status_code=404)
 
+    etag = weak_etag(row["updated_at"])
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+
     return {
         "id": str(row["id"]),
         "title": row["title"],
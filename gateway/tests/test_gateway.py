@@ -1,6 +1,37 @@
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import jwt
+import pytest
+from fastapi import Request
 from fastapi.testclient import TestClient
 
-from app.main import app, create_access_token
+from app.main import (
+    ApiError,
+    app,
+    build_admin_users_sql,
+    create_access_token,
+    decode_page_cursor,
+    encode_page_cursor,
+    get_db_pool,
+    etag_matches,
+    get_settings,
+    issue_impersonation_token,
+    payments_buffer,
+    payments_flush_lock,
+    record_payment,
+    weak_etag,
+)
+
+
+@pytest.fixture
+def jwt_secret(monkeypatch):
+    monkeypatch.setenv("JWT_SECRET", "test-secret")
+    get_settings.cache_clear()
+    yield "test-secret"
+    get_settings.cache_clear()
 
 
 def test_health_endpoint():
@@ -11,9 +42,238 @@ def test_health_endpoint():
     assert response.json()["status"] == "ok"
 
 
+def test_public_pricing_lists_all_plans():
+    client = TestClient(app)
+    response = client.get("/api/public/pricing")
+
+    assert response.status_code == 200
+    assert [item["plan"] for item in response.json()["plans"]] == ["free", "pro", "team", "business"]
+    assert client.get("/api/billing/plans").content == response.content
+
+
 def test_create_access_token(monkeypatch):
     monkeypatch.setenv("JWT_SECRET", "test-secret")
+    get_settings.cache_clear()
     token = create_access_token("user-id", "user@example.com")
 
     assert isinstance(token, str)
     assert token.count(".") == 2
+
+
+def test_invalid_token_is_rejected(monkeypatch):
+    monkeypatch.setenv("JWT_SECRET", "test-secret")
+    get_settings.cache_clear()
+    client = TestClient(app)
+    response = client.get("/api/me", headers={"Authorization": "Bearer not-a-token"})
+
+    assert response.status_code == 401
+    assert response.json()["error"]["code"] == "UNAUTHORIZED"
+
+
+def test_impersonation_token_is_reused_per_target_claims(monkeypatch):
+    monkeypatch.setenv("JWT_SECRET", "test-secret")
+    get_settings.cache_clear()
+    token = issue_impersonation_token("admin-id", "user-id", "user@example.com", "user", "free")
+
+    assert issue_impersonation_token("admin-id", "user-id", "user@example.com", "user", "free") == token
+    assert issue_impersonation_token("admin-id", "user-id", "user@example.com", "user", "pro") != token
+
+
+def test_page_cursor_round_trip():
+    created_at = datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=timezone.utc)
+    row_id = uuid.uuid4()
+
+    cursor = encode_page_cursor(created_at, row_id)
+
+    assert decode_page_cursor(cursor) == (created_at, str(row_id))
+
+
+def test_decode_page_cursor_rejects_garbage():
+    with pytest.raises(ApiError) as error:
+        decode_page_cursor("not-a-cursor")
+
+    assert error.value.code == "INVALID_CURSOR"
+
+
+def test_admin_users_sql_is_cached_per_filter_shape():
+    query = build_admin_users_sql(True, False, True, True)
+
+    assert build_admin_users_sql(True, False, True, True) is query
+    assert query.count("%s") == 2 + 1 + 2 + 1
+    assert "OFFSET" not in query
+    assert build_admin_users_sql(False, False, False, False).count("%s") == 2
+
+
+def test_weak_etag_tracks_every_timestamp():
+    updated_at = datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=timezone.utc)
+    etag = weak_etag(updated_at, None)
+
+    assert etag.startswith('W/"')
+    assert weak_etag(updated_at, updated_at) != etag
+
+    request = Request({"type": "http", "headers": [(b"if-none-match", f'"other", {etag}'.encode())]})
+    assert etag_matches(request, etag)
+    assert not etag_matches(Request({"type": "http", "headers": []}), etag)
+
+
+def test_auth_middleware_resolves_bearer_subject(monkeypatch, jwt_secret):
+    token = create_access_token("user-id", "user@example.com", "user", "free")
+    lookups: list[tuple] = []
+    monkeypatch.setattr("app.main.db_fetchone", lambda query, params=(): lookups.append(params))
+    client = TestClient(app)
+
+    client.get("/api/v1/sources/source-id", headers={"Authorization": f"Bearer {token}"})
+    assert lookups == [("source-id", "user-id")]
+
+    response = client.get("/api/v1/sources/source-id")
+    assert response.status_code == 401
+    assert response.json()["error"]["message"] == "Authorization token is required"
+
+
+def test_oversized_upload_is_rejected_before_parsing(monkeypatch):
+    monkeypatch.setenv("MAX_UPLOAD_BYTES", "16")
+    get_settings.cache_clear()
+    client = TestClient(app)
+
+    response = client.post("/api/v1/sources", files={"file": ("doc.txt", b"x" * 64, "text/plain")})
+
+    get_settings.cache_clear()
+    assert response.status_code == 413
+    assert response.json()["error"]["code"] == "FILE_TOO_LARGE"
+
+def test_oversized_streamed_upload_is_rejected(monkeypatch):
+    monkeypatch.setenv("MAX_UPLOAD_BYTES", "16")
+    get_settings.cache_clear()
+    boundary = "upload-boundary"
+    body = (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"doc.txt\"\r\n"
+        f"Content-Type: text/plain\r\n\r\n{'x' * 64}\r\n--{boundary}--\r\n"
+    ).encode()
+
+    try:
+        response = TestClient(app).post(
+            "/api/v1/sources",
+            content=(body[start : start + 16] for start in range(0, len(body), 16)),
+            headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+        )
+    finally:
+        get_settings.cache_clear()
+
+    assert response.status_code == 413
+    assert response.json()["error"]["code"] == "FILE_TOO_LARGE"
+
+
+def test_failed_payment_batch_only_fails_the_bad_row(monkeypatch):
+    stored: list[tuple] = []
+
+    def executemany(query, params_seq):
+        raise ValueError("batch rejected")
+
+    def execute(query, params=()):
+        if params[0] == "bad":
+            raise ValueError("bad subscription")
+        stored.append(params)
+        return 1
+
+    monkeypatch.setattr("app.main.db_executemany", executemany)
+    monkeypatch.setattr("app.main.db_execute", execute)
+    errors: dict[str, Exception | None] = {}
+
+    def pay(subscription_id: str) -> None:
+        try:
+            record_payment((subscription_id, 10, "RUB", "succeeded", "{}"))
+            errors[subscription_id] = None
+        except ValueError as exc:
+            errors[subscription_id] = exc
+
+    with payments_flush_lock:
+        threads = [threading.Thread(target=pay, args=(subscription_id,)) for subscription_id in ("good", "bad")]
+        for thread in threads:
+            thread.start()
+        while len(payments_buffer) < 2:
+            time.sleep(0.01)
+    for thread in threads:
+        thread.join(timeout=2)
+
+    assert errors["good"] is None
+    assert str(errors["bad"]) == "bad subscription"
+    assert stored == [("good", 10, "RUB", "succeeded", "{}")]
+
+
+def test_missing_jwt_secret_only_fails_authenticated_routes(monkeypatch):
+    monkeypatch.delenv("JWT_SECRET", raising=False)
+    get_settings.cache_clear()
+    client = TestClient(app)
+    headers = {"Authorization": "Bearer some-token"}
+
+    try:
+        assert client.get("/health", headers=headers).status_code == 200
+        response = client.get("/api/me", headers=headers)
+    finally:
+        get_settings.cache_clear()
+
+    assert response.status_code == 500
+    assert response.json()["error"]["code"] == "MISSING_JWT_SECRET"
+
+
+def test_db_pool_checks_connections_before_handing_them_out(monkeypatch):
+    created: dict = {}
+
+    class RecordingPool:
+        check_connection = object()
+
+        def __init__(self, conninfo, **kwargs):
+            created.update(kwargs)
+
+    monkeypatch.setattr("app.main.ConnectionPool", RecordingPool)
+    monkeypatch.setattr("app.main.db_pool", None)
+    monkeypatch.setenv("POSTGRES_URL", "postgresql://localhost/test")
+    get_settings.cache_clear()
+
+    try:
+        get_db_pool()
+    finally:
+        get_settings.cache_clear()
+
+    assert created["check"] is RecordingPool.check_connection
+
+
+@pytest.mark.parametrize(
+    ("row", "status_code"),
+    [(None, 401), ({"user_status": "blocked", "deleted_at": None}, 403)],
+    ids=["missing-user", "blocked-user"],
+)
+def test_source_details_checks_the_caller_row(monkeypatch, jwt_secret, row, status_code):
+    monkeypatch.setattr("app.main.db_fetchone", lambda query, params=(): row)
+    token = create_access_token("user-id", "user@example.com")
+
+    response = TestClient(app).get("/api/v1/sources/source-id", headers={"Authorization": f"Bearer {token}"})
+
+    assert response.status_code == status_code
+
+
+@pytest.mark.parametrize(
+    "claims",
+    [
+        {"sub": "user-id", "exp": datetime.now(timezone.utc) - timedelta(minutes=1)},
+        {"sub": "user-id", "aud": "another-service"},
+    ],
+    ids=["expired", "wrong-audience"],
+)
+def test_rejected_tokens_get_401(jwt_secret, claims):
+    token = jwt.encode(claims, jwt_secret, algorithm=get_settings().jwt_algorithm)
+
+    response = TestClient(app).get("/api/v1/sources/source-id", headers={"Authorization": f"Bearer {token}"})
+
+    assert response.status_code == 401
+    assert response.json()["error"]["message"] == "Token is invalid or expired"
+
+
+def test_admin_routes_reject_non_admin_users(monkeypatch, jwt_secret):
+    monkeypatch.setattr("app.main.load_auth_user", lambda user_id: {"id": user_id, "role": "user", "status": "active", "deleted_at": None})
+    token = create_access_token("user-id", "user@example.com")
+
+    response = TestClient(app).get("/api/feedback", headers={"Authorization": f"Bearer {token}"})
+
+    assert response.status_code == 403
+    assert response.json()["error"]["message"] == "Admin role required"
@@ -0,0 +1,25 @@
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_users_created_at_id_active
+ON users (created_at DESC, id DESC)
+WHERE deleted_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_courses_updated_at_id_active
+ON courses (updated_at DESC, id DESC)
+WHERE deleted_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_users_email_trgm
+ON users USING gin (email gin_trgm_ops)
+WHERE deleted_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_users_name_trgm
+ON users USING gin (name gin_trgm_ops)
+WHERE deleted_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_courses_title_trgm
+ON courses USING gin (title gin_trgm_ops)
+WHERE deleted_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_courses_goal_trgm
+ON courses USING gin (goal gin_trgm_ops)
+WHERE deleted_at IS NULL;
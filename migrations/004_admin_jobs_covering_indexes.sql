@@ -0,0 +1,7 @@
+CREATE INDEX IF NOT EXISTS idx_course_builds_created_at_covering
+ON course_builds (created_at DESC)
+INCLUDE (status, course_id, step, progress_pct);
+
+CREATE INDEX IF NOT EXISTS idx_jobs_created_at_covering
+ON jobs (created_at DESC)
+INCLUDE (status, source_id);
@@ -1,15 +1,26 @@
+import asyncio
 import io
+import multiprocessing
 import os
+import shutil
+import tempfile
+import threading
 import uuid
-from typing import Any
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections.abc import Iterator
+from contextlib import asynccontextmanager
+from typing import Any, BinaryIO
 
 import fitz
+import msgspec
 import pytesseract
 from docx import Document as DocxDocument
-from fastapi import FastAPI, File, Request, UploadFile
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, File, Request, Response, UploadFile
+from fastapi.responses import JSONResponse, ORJSONResponse
 from PIL import Image
 from pydantic import BaseModel, Field
+from starlette.formparsers import MultiPartParser
 
 
 class ApiError(Exception):
@@ -34,53 +45,231 @@ class ParseResponse(BaseModel):
     chunks: list[ChunkOut]
 
 
-app = FastAPI(title="Parser/OCR Service", version="0.1.0")
+class ChunkRecord(msgspec.Struct, kw_only=True, gc=False):
+    index: int
+    text: str
+    lang: str = "ru"
+    token_count: int
+    metadata: dict[str, Any]
 
 
-def split_to_chunks(text: str, max_chars: int = 1200, overlap: int = 200) -> list[str]:
+parse_encoder = msgspec.json.Encoder()
+
+
+ocr_executor: ProcessPoolExecutor | None = None
+paddle_ocr: Any = None
+paddle_ocr_lock = threading.Lock()
+
+
+def bool_env(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.lower() in {"1", "true", "yes", "on"}
+
+
+def ocr_backend() -> str:
+    return os.getenv("OCR_BACKEND", "tesseract").strip().lower()
+
+
+def get_paddle_ocr() -> Any:
+    global paddle_ocr
+    if paddle_ocr is None:
+        try:
+            from paddleocr import PaddleOCR
+        except ImportError as error:
+            raise ApiError(
+                code="OCR_BACKEND_UNAVAILABLE",
+                message="OCR_BACKEND=paddle requires the paddleocr package",
+                status_code=500,
+            ) from error
+        paddle_ocr = PaddleOCR(
+            lang=os.getenv("PADDLE_OCR_LANG", "ru"),
+            device="gpu" if bool_env("PADDLE_OCR_USE_GPU", False) else "cpu",
+            use_doc_orientation_classify=False,
+            use_doc_unwarping=False,
+            use_textline_orientation=False,
+        )
+    return paddle_ocr
+
+
+def paddle_batch_pages() -> int:
+    return max(1, int(os.getenv("PADDLE_OCR_BATCH_PAGES", "8")))
+
+
+def ocr_worker_count() -> int:
+    return int(os.getenv("OCR_WORKERS", "0")) or os.cpu_count() or 1
+
+
+def get_ocr_executor() -> ProcessPoolExecutor:
+    global ocr_executor
+    if ocr_executor is None:
+        ocr_executor = ProcessPoolExecutor(max_workers=ocr_worker_count(), mp_context=multiprocessing.get_context("spawn"))
+    return ocr_executor
+
+
+def reset_ocr_executor(broken: ProcessPoolExecutor) -> None:
+    global ocr_executor
+    broken.shutdown(wait=False, cancel_futures=True)
+    if ocr_executor is broken:
+        ocr_executor = None
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    if ocr_backend() == "paddle":
+        await asyncio.to_thread(get_paddle_ocr)
+    yield
+    global ocr_executor
+    if ocr_executor is not None:
+        ocr_executor.shutdown(cancel_futures=True)
+        ocr_executor = None
+
+
+app = FastAPI(title="Parser/OCR Service", version="0.1.0", lifespan=lifespan, default_response_class=ORJSONResponse)
+
+# Process-wide on purpose: every multipart form in this service spools uploads above this size to a temp file.
+MultiPartParser.max_file_size = int(os.getenv("UPLOAD_SPOOL_MAX_BYTES", str(4 * 1024 * 1024)))
+
+
+def max_upload_bytes() -> int:
+    return int(os.getenv("MAX_UPLOAD_BYTES", str(100 * 1024 * 1024)))
+
+
+def iter_chunks(text: str, max_chars: int = 1200, overlap: int = 200) -> Iterator[tuple[str, int]]:
     normalized = " ".join(text.split())
     if not normalized:
-        return []
+        return
 
-    chunks: list[str] = []
     start = 0
     length = len(normalized)
 
     while start < length:
         end = min(start + max_chars, length)
-        chunk = normalized[start:end].strip()
-        if chunk:
-            chunks.append(chunk)
+        if end < length:
+            boundary = normalized.rfind(" ", start, end + 1)
+            if boundary > start:
+                end = boundary
+        chunk = normalized[start:end]
+        yield chunk, chunk.count(" ") + 1
         if end >= length:
             break
-        start = max(0, end - overlap)
+        if normalized[end] != " ":
+            start = end
+            continue
+
+        next_word_end = normalized.find(" ", end + 1)
+        if next_word_end == -1:
+            next_word_end = length
+        next_start = min(max(end - overlap, next_word_end - max_chars, start + 1), end + 1)
+        if normalized[next_start - 1] != " ":
+            next_start = normalized.find(" ", next_start, end + 1) + 1
+        start = next_start
 
-    return chunks
 
+def split_to_chunks(text: str, max_chars: int = 1200, overlap: int = 200) -> list[str]:
+    return [chunk for chunk, _ in iter_chunks(text, max_chars, overlap)]
 
-def token_count(text: str) -> int:
-    return len(text.split())
 
+PageImage = tuple[int, int, int, bytes]
 
-def extract_pdf(file_bytes: bytes) -> tuple[list[tuple[int, str]], int]:
-    language = os.getenv("TESSERACT_LANG", "rus")
-    pages: list[tuple[int, str]] = []
 
-    with fitz.open(stream=file_bytes, filetype="pdf") as pdf:
-        total_pages = pdf.page_count
-        for page_index in range(total_pages):
+def render_page_image(page: fitz.Page) -> PageImage:
+    pix = page.get_pixmap(dpi=220, colorspace=fitz.csGRAY)
+    return pix.width, pix.height, pix.stride, pix.samples
+
+
+def ocr_page_image(page_image: PageImage, language: str) -> str:
+    width, height, stride, samples = page_image
+    image = Image.frombuffer("L", (width, height), samples, "raw", "L", stride, 1)
+    try:
+        return pytesseract.image_to_string(image, lang=language).strip()
+    except Exception as error:
+        # pytesseract errors do not survive pickling back from a worker process.
+        raise RuntimeError(f"OCR failed: {error}") from None
+
+
+def paddle_ocr_pages(path: str, page_indices: list[int]) -> list[str]:
+    import numpy as np
+
+    images = []
+    with fitz.open(path, filetype="pdf") as pdf:
+        for page_index in page_indices:
+            width, height, stride, samples = render_page_image(pdf[page_index])
+            gray = np.frombuffer(samples, dtype=np.uint8).reshape(height, stride)[:, :width]
+            images.append(np.repeat(gray[:, :, None], 3, axis=2))
+
+    with paddle_ocr_lock:
+        results = get_paddle_ocr().predict(images)
+    return [" ".join(result["rec_texts"]).strip() for result in results]
+
+
+def spool_upload(source: BinaryIO, suffix: str) -> str:
+    source.seek(0)
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as target:
+        shutil.copyfileobj(source, target, length=1 << 20)
+    return target.name
+
+
+def extract_page_range(
+    path: str,
+    start: int,
+    stop: int,
+    language: str | None,
+) -> tuple[list[tuple[int, str]], list[int]]:
+    texts: list[tuple[int, str]] = []
+    scanned: list[int] = []
+
+    with fitz.open(path, filetype="pdf") as pdf:
+        for page_index in range(start, stop):
             page = pdf[page_index]
             text = (page.get_text("text") or "").strip()
 
-            if not text:
-                pix = page.get_pixmap(dpi=220)
-                image_bytes = pix.tobytes("png")
-                image = Image.open(io.BytesIO(image_bytes))
-                text = pytesseract.image_to_string(image, lang=language).strip()
-
             if text:
-                pages.append((page_index + 1, text))
+                texts.append((page_index, text))
+            elif language is None:
+                scanned.append(page_index)
+            else:
+                texts.append((page_index, ocr_page_image(render_page_image(page), language)))
+
+    return texts, scanned
+
 
+async def extract_pdf(path: str) -> tuple[list[tuple[int, str]], int]:
+    language = None if ocr_backend() == "paddle" else os.getenv("TESSERACT_LANG", "rus")
+    texts: dict[int, str] = {}
+    scanned: list[int] = []
+
+    with fitz.open(path, filetype="pdf") as pdf:
+        total_pages = pdf.page_count
+
+    batch_size = max(1, -(-total_pages // (ocr_worker_count() * 4)))
+    ranges = [(start, min(start + batch_size, total_pages)) for start in range(0, total_pages, batch_size)]
+    loop = asyncio.get_running_loop()
+    for attempt in range(2):
+        executor = get_ocr_executor()
+        try:
+            parts = await asyncio.gather(
+                *(loop.run_in_executor(executor, extract_page_range, path, start, stop, language) for start, stop in ranges)
+            )
+            break
+        except BrokenProcessPool:
+            # A worker died (OOM, MuPDF crash); the pool is unusable, so replace it and retry once.
+            reset_ocr_executor(executor)
+            if attempt:
+                raise
+    for part_texts, part_scanned in parts:
+        texts.update(part_texts)
+        scanned.extend(part_scanned)
+
+    # Scanned pages are rendered and recognised a batch at a time, so at most one batch of images is in memory.
+    batch_pages = paddle_batch_pages()
+    for start in range(0, len(scanned), batch_pages):
+        page_indices = scanned[start : start + batch_pages]
+        results = await asyncio.to_thread(paddle_ocr_pages, path, page_indices)
+        texts.update(zip(page_indices, results))
+
+    pages = [(page_index + 1, texts[page_index]) for page_index in sorted(texts) if texts[page_index]]
     return pages, total_pages
 
 
@@ -97,6 +286,75 @@ def extract_plain_text(file_bytes: bytes) -> str:
         return file_bytes.decode("latin-1", errors="ignore")
 
 
+def upload_error_response(limit: int, received: int | None) -> JSONResponse:
+    if received == 0:
+        return JSONResponse(
+            status_code=400,
+            content={"error": {"code": "EMPTY_FILE", "message": "Uploaded file is empty", "details": {}}},
+        )
+    return JSONResponse(
+        status_code=413,
+        content={"error": {"code": "FILE_TOO_LARGE", "message": "Uploaded file is too large", "details": {"max_bytes": limit}}},
+    )
+
+
+class UploadSizeLimitMiddleware:
+    """Rejects empty or oversized upload bodies before FastAPI parses the multipart form.
+
+    Content-Length is checked up front; bodies without one are counted as they stream in.
+    """
+
+    def __init__(self, app: Any, paths: frozenset[str]):
+        self.app = app
+        self.paths = paths
+
+    async def __call__(self, scope: dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        limit = max_upload_bytes()
+        content_length = next((value for name, value in scope["headers"] if name == b"content-length"), None)
+        if content_length is not None and content_length.isdigit():
+            declared = int(content_length)
+            if declared == 0 or declared > limit:
+                await upload_error_response(limit, declared)(scope, receive, send)
+                return
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def limited_receive() -> dict[str, Any]:
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Starlette turns the disconnect into a parse error; guarded_send swaps in the 413.
+                    exceeded = True
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message: dict[str, Any]) -> None:
+            nonlocal response_started
+            if exceeded:
+                return
+            response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not exceeded:
+                raise
+        if exceeded and not response_started:
+            await upload_error_response(limit, received)(scope, receive, send)
+
+
+app.add_middleware(UploadSizeLimitMiddleware, paths=frozenset({"/parse"}))
+
+
 @app.middleware("http")
 async def request_id_middleware(request: Request, call_next):
     request_id = request.headers.get("X-Request-Id", str(uuid.uuid4()))
@@ -134,50 +392,55 @@ def health() -> dict[str, str]:
 
 
 @app.post("/parse", response_model=ParseResponse)
-async def parse(file: UploadFile = File(...)) -> ParseResponse:
-    file_bytes = await file.read()
-    if not file_bytes:
+async def parse(file: UploadFile = File(...)) -> Response:
+    file.file.seek(0, os.SEEK_END)
+    if file.file.tell() == 0:
         raise ApiError(code="EMPTY_FILE", message="Uploaded file is empty", status_code=400)
+    file.file.seek(0)
 
     filename = file.filename or "document"
     lower_name = filename.lower()
-    chunks: list[ChunkOut] = []
+    chunks: list[ChunkRecord] = []
     chunk_index = 0
     page_count = 1
 
     if lower_name.endswith(".pdf"):
-        pages, page_count = extract_pdf(file_bytes)
+        pdf_path = await asyncio.to_thread(spool_upload, file.file, ".pdf")
+        try:
+            pages, page_count = await extract_pdf(pdf_path)
+        finally:
+            os.unlink(pdf_path)
         for page, text in pages:
-            for piece in split_to_chunks(text):
+            for piece, tokens in iter_chunks(text):
                 chunks.append(
-                    ChunkOut(
+                    ChunkRecord(
                         index=chunk_index,
                         text=piece,
-                        token_count=token_count(piece),
+                        token_count=tokens,
                         metadata={"page": page},
                     )
                 )
                 chunk_index += 1
     elif lower_name.endswith(".docx"):
-        doc_text = extract_docx(file_bytes)
-        for piece in split_to_chunks(doc_text):
+        doc_text = extract_docx(await file.read())
+        for piece, tokens in iter_chunks(doc_text):
             chunks.append(
-                ChunkOut(
+                ChunkRecord(
                     index=chunk_index,
                     text=piece,
-                    token_count=token_count(piece),
+                    token_count=tokens,
                     metadata={"page": 1},
                 )
             )
             chunk_index += 1
     else:
-        raw_text = extract_plain_text(file_bytes)
-        for piece in split_to_chunks(raw_text):
+        raw_text = extract_plain_text(await file.read())
+        for piece, tokens in iter_chunks(raw_text):
             chunks.append(
-                ChunkOut(
+                ChunkRecord(
                     index=chunk_index,
                     text=piece,
-                    token_count=token_count(piece),
+                    token_count=tokens,
                     metadata={"page": 1},
                 )
             )
@@ -186,4 +449,5 @@ async def parse(file: UploadFile = File(...)) -> ParseResponse:
     if not chunks:
         raise ApiError(code="NO_TEXT_EXTRACTED", message="No text was extracted from the file", status_code=422)
 
-    return ParseResponse(document_meta={"filename": filename, "pages": page_count}, chunks=chunks)
+    content = parse_encoder.encode({"document_meta": {"filename": filename, "pages": page_count}, "chunks": chunks})
+    return Response(content=content, media_type="application/json")
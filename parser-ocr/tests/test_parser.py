@@ -1,5 +1,9 @@
+import os
+
+import fitz
 from fastapi.testclient import TestClient
 
+from app import main
 from app.main import app, split_to_chunks
 
 
@@ -11,6 +15,18 @@ def test_split_to_chunks_returns_chunks_for_long_text():
     assert all(chunk.strip() for chunk in chunks)
 
 
+def test_split_to_chunks_keeps_whole_words_with_overlap():
+    words = [f"w{index}" for index in range(300)]
+    chunks = split_to_chunks(" ".join(words), max_chars=50, overlap=10)
+
+    assert all(len(chunk) <= 50 for chunk in chunks)
+    assert all(set(chunk.split()) <= set(words) for chunk in chunks)
+    assert chunks[0].split()[0] == "w0"
+    assert chunks[-1].split()[-1] == "w299"
+    for previous, current in zip(chunks, chunks[1:]):
+        assert current.split()[0] in previous.split()
+
+
 def test_parse_plain_text_file_success():
     client = TestClient(app)
 
@@ -24,3 +40,83 @@ def test_parse_plain_text_file_success():
     assert payload["document_meta"]["filename"] == "doc.txt"
     assert payload["chunks"]
     assert payload["chunks"][0]["lang"] == "ru"
+
+
+def test_parse_rejects_oversized_upload(monkeypatch):
+    monkeypatch.setenv("MAX_UPLOAD_BYTES", "16")
+    client = TestClient(app)
+
+    response = client.post("/parse", files={"file": ("doc.txt", b"x" * 64, "text/plain")})
+
+    assert response.status_code == 413
+    assert response.json()["error"]["code"] == "FILE_TOO_LARGE"
+
+def test_parse_rejects_oversized_streamed_upload(monkeypatch):
+    monkeypatch.setenv("MAX_UPLOAD_BYTES", "16")
+    boundary = "upload-boundary"
+    body = (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"doc.txt\"\r\n"
+        f"Content-Type: text/plain\r\n\r\n{'x' * 64}\r\n--{boundary}--\r\n"
+    ).encode()
+
+    response = TestClient(app).post(
+        "/parse",
+        content=(body[start : start + 16] for start in range(0, len(body), 16)),
+        headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+    )
+
+    assert response.status_code == 413
+    assert response.json()["error"]["code"] == "FILE_TOO_LARGE"
+
+
+def test_parse_pdf_recovers_from_broken_ocr_pool(monkeypatch):
+    monkeypatch.setenv("OCR_WORKERS", "1")
+    document = fitz.open()
+    document.new_page().insert_text((72, 72), "Hello from page one")
+    pdf_bytes = document.tobytes()
+    document.close()
+
+    broken = main.get_ocr_executor()
+    broken.submit(os._exit, 1)
+    broken.shutdown(wait=True)
+
+    try:
+        response = TestClient(app).post("/parse", files={"file": ("doc.pdf", pdf_bytes, "application/pdf")})
+
+        assert response.status_code == 200
+        assert response.json()["chunks"][0]["text"] == "Hello from page one"
+        assert main.ocr_executor is not broken
+    finally:
+        if main.ocr_executor is not None:
+            main.ocr_executor.shutdown()
+        main.ocr_executor = None
+
+
+def test_paddle_backend_recognises_scanned_pages_in_batches(monkeypatch):
+    monkeypatch.setenv("OCR_WORKERS", "1")
+    monkeypatch.setenv("OCR_BACKEND", "paddle")
+    monkeypatch.setenv("PADDLE_OCR_BATCH_PAGES", "2")
+    document = fitz.open()
+    for _ in range(3):
+        document.new_page()
+    pdf_bytes = document.tobytes()
+    document.close()
+
+    batches: list[int] = []
+
+    class FakePaddle:
+        def predict(self, images):
+            batches.append(len(images))
+            return [{"rec_texts": ["scanned", "text"]} for _ in images]
+
+    monkeypatch.setattr(main, "get_paddle_ocr", lambda: FakePaddle())
+    try:
+        response = TestClient(app).post("/parse", files={"file": ("scan.pdf", pdf_bytes, "application/pdf")})
+    finally:
+        if main.ocr_executor is not None:
+            main.ocr_executor.shutdown()
+            main.ocr_executor = None
+
+    assert response.status_code == 200
+    assert batches == [2, 1]
+    assert [chunk["metadata"]["page"] for chunk in response.json()["chunks"]] == [1, 2, 3]
@@ -1,16 +1,27 @@
-import json
+import asyncio
+import hashlib
+import itertools
+import math
 import os
+import sqlite3
 import threading
 import uuid
+from collections.abc import Iterator
+from contextlib import asynccontextmanager, contextmanager
 from pathlib import Path
 from typing import Any
 
+# OpenMP reads the thread count once when faiss loads it; omp_set_num_threads only reaches the calling thread.
+os.environ["OMP_NUM_THREADS"] = os.getenv("FAISS_OMP_THREADS") or os.getenv("OMP_NUM_THREADS") or str(min(4, os.cpu_count() or 1))
+
 import faiss
 import httpx
+import msgpack
 import numpy as np
+import orjson
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel, Field
+from fastapi.responses import JSONResponse, ORJSONResponse
+from pydantic import BaseModel, Field, TypeAdapter
 
 
 class ApiError(Exception):
@@ -36,6 +47,9 @@ class ChunkMeta(BaseModel):
     metadata: dict[str, Any] = Field(default_factory=dict)
 
 
+CHUNK_LIST_ADAPTER = TypeAdapter(list[ChunkMeta])
+
+
 class IndexRequest(BaseModel):
     source_id: str
     embeddings: list[EmbeddingIn]
@@ -47,10 +61,16 @@ class IndexResponse(BaseModel):
     indexed: int
 
 
+MAX_BATCH_QUERIES = 64
+# Stays well under SQLITE_MAX_VARIABLE_NUMBER, which is 999 on older builds.
+META_FETCH_BATCH = 500
+
+
 class SearchRequest(BaseModel):
     source_id: str
     query_vector: list[float] | None = None
     query_text: str | None = None
+    query_is_normalized: bool = False
     top_k: int = 5
 
 
@@ -65,36 +85,356 @@ class SearchResponse(BaseModel):
     results: list[SearchResult]
 
 
-app = FastAPI(title="Retrieval Service", version="0.1.0")
+class SearchBatchRequest(BaseModel):
+    source_id: str
+    query_vectors: list[list[float]]
+    query_is_normalized: bool = False
+    top_k: int = 5
+
+
+class SearchBatchResponse(BaseModel):
+    results: list[list[SearchResult]]
+
+
+embedding_client: httpx.AsyncClient | None = None
+
+
+def get_embedding_client() -> httpx.AsyncClient:
+    global embedding_client
+    if embedding_client is None:
+        embedding_client = httpx.AsyncClient(
+            base_url=os.getenv("EMBEDDING_URL", "http://embedding:8000"),
+            timeout=30.0,
+            limits=httpx.Limits(
+                max_connections=int(os.getenv("EMBEDDING_HTTP_MAX_CONNECTIONS", "64")),
+                max_keepalive_connections=int(os.getenv("EMBEDDING_HTTP_MAX_KEEPALIVE", "32")),
+            ),
+        )
+    return embedding_client
+
+
+async def close_embedding_client() -> None:
+    global embedding_client
+    if embedding_client is not None:
+        await embedding_client.aclose()
+        embedding_client = None
+
+
+def warm_up_faiss() -> None:
+    probe = faiss.IndexFlatIP(8)
+    probe.add(np.ones((32, 8), dtype=np.float32))
+    probe.search(np.ones((32, 8), dtype=np.float32), 1)
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    await asyncio.to_thread(warm_up_faiss)
+    yield
+    await close_embedding_client()
+
+
+faiss.cvar.distance_compute_blas_threshold = 16
+app = FastAPI(title="Retrieval Service", version="0.1.0", lifespan=lifespan, default_response_class=ORJSONResponse)
 DATA_DIR = Path(os.getenv("FAISS_DATA_DIR", "/data/faiss"))
 DATA_DIR.mkdir(parents=True, exist_ok=True)
-LOCK = threading.Lock()
+SOURCE_LOCKS_GUARD = threading.Lock()
+INDEX_CACHE_LOCK = threading.Lock()
+LEGACY_UPGRADE_LOCK = threading.Lock()
+INDEX_CACHE_SIZE = int(os.getenv("INDEX_CACHE_SIZE", "64"))
+ANN_INDEX_THRESHOLD = int(os.getenv("ANN_INDEX_THRESHOLD", "2000"))
+ANN_INDEX_TYPE = os.getenv("ANN_INDEX_TYPE", "hnsw").strip().lower()
+FLAT_INDEX_TYPE = os.getenv("FLAT_INDEX_TYPE", "flat").strip().lower()
+HNSW_M = int(os.getenv("HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "200"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+IVF_NLIST = int(os.getenv("IVF_NLIST", "0"))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))
+PQ_M = int(os.getenv("PQ_M", "0"))
+QUERY_BUFFER_MAX_ROWS = 64
+query_buffers = threading.local()
+INDEX_MMAP_MIN_BYTES = int(os.getenv("INDEX_MMAP_MIN_BYTES", str(256 * 1024 * 1024)))
+INDEX_CACHE: dict[str, tuple[int, faiss.IndexIDMap2, bool]] = {}
+
+
+# A waiting writer blocks new readers, so steady searches cannot starve /index.
+class ReadWriteLock:
+    def __init__(self) -> None:
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self) -> Iterator[None]:
+        with self._condition:
+            while self._writer or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self) -> Iterator[None]:
+        with self._condition:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writer = False
+                self._condition.notify_all()
+
+
+SOURCE_LOCKS: dict[str, ReadWriteLock] = {}
+
+
+def source_lock(source_id: str) -> ReadWriteLock:
+    with SOURCE_LOCKS_GUARD:
+        lock = SOURCE_LOCKS.get(source_id)
+        if lock is None:
+            lock = SOURCE_LOCKS[source_id] = ReadWriteLock()
+        return lock
 
 
 def index_path(source_id: str) -> Path:
     return DATA_DIR / f"index_{source_id}.faiss"
 
 
-def meta_path(source_id: str) -> Path:
+def meta_db_path(source_id: str) -> Path:
+    return DATA_DIR / f"meta_{source_id}.sqlite"
+
+
+def index_info_path(source_id: str) -> Path:
+    return DATA_DIR / f"meta_{source_id}.info.json"
+
+
+def legacy_meta_path(source_id: str) -> Path:
     return DATA_DIR / f"meta_{source_id}.json"
 
 
-def load_meta(source_id: str) -> list[dict[str, Any]]:
-    path = meta_path(source_id)
-    if not path.exists():
-        return []
-    with path.open("r", encoding="utf-8") as file:
-        return json.load(file)
+def embeddings_to_matrix(embeddings: list[EmbeddingIn], dim: int) -> np.ndarray:
+    for item in embeddings:
+        if item.dim != dim:
+            raise ApiError(code="MIXED_DIM", message="All embeddings must share the same dimension", status_code=400)
+        if len(item.vector) != dim:
+            raise ApiError(
+                code="DIMENSION_MISMATCH",
+                message="Vector length does not match embedding dim",
+                status_code=400,
+                details={"chunk_id": item.chunk_id},
+            )
+    flat = itertools.chain.from_iterable(item.vector for item in embeddings)
+    return np.fromiter(flat, dtype=np.float32, count=len(embeddings) * dim).reshape(len(embeddings), dim)
+
+
+def chunk_records(embeddings: list[EmbeddingIn], chunks: list[ChunkMeta]) -> list[dict[str, Any]]:
+    if len(chunks) == len(embeddings) and all(chunk.chunk_id == item.chunk_id for item, chunk in zip(embeddings, chunks)):
+        return CHUNK_LIST_ADAPTER.dump_python(chunks)
+    by_id = {chunk.chunk_id: chunk for chunk in chunks}
+    records: list[dict[str, Any]] = []
+    for item in embeddings:
+        chunk = by_id.get(item.chunk_id)
+        records.append(chunk.model_dump() if chunk else {"chunk_id": item.chunk_id, "text": "", "metadata": {}})
+    return records
+
+
+def chunk_key(chunk_id: str) -> int:
+    # 63-bit so keys never collide with FAISS's -1 "no result" label.
+    return int.from_bytes(hashlib.blake2b(chunk_id.encode("utf-8"), digest_size=8).digest(), "little") & 0x7FFF_FFFF_FFFF_FFFF
+
+
+def store_meta(source_id: str, ids: np.ndarray, items: list[dict[str, Any]]) -> None:
+    connection = sqlite3.connect(meta_db_path(source_id), timeout=30.0)
+    try:
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("CREATE TABLE IF NOT EXISTS chunks (id INTEGER PRIMARY KEY, record BLOB NOT NULL)")
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO chunks (id, record) VALUES (?, ?)",
+                zip(ids.tolist(), (msgpack.packb(item, use_bin_type=True) for item in items)),
+            )
+    finally:
+        connection.close()
+
+
+def fetch_meta(source_id: str, ids: set[int]) -> dict[int, dict[str, Any]]:
+    path = meta_db_path(source_id)
+    if not ids or not path.exists():
+        return {}
+    keys = list(ids)
+    rows: list[tuple[int, bytes]] = []
+    connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=30.0)
+    try:
+        for start in range(0, len(keys), META_FETCH_BATCH):
+            batch = keys[start : start + META_FETCH_BATCH]
+            rows.extend(
+                connection.execute(f"SELECT id, record FROM chunks WHERE id IN ({','.join('?' * len(batch))})", batch)
+            )
+    finally:
+        connection.close()
+    return {row_id: msgpack.unpackb(record, raw=False) for row_id, record in rows}
 
 
-def save_meta(source_id: str, items: list[dict[str, Any]]) -> None:
-    path = meta_path(source_id)
-    with path.open("w", encoding="utf-8") as file:
-        json.dump(items, file, ensure_ascii=False)
+def load_legacy_meta(source_id: str) -> list[dict[str, Any]]:
+    legacy_path = legacy_meta_path(source_id)
+    if not legacy_path.exists():
+        return []
+    return orjson.loads(legacy_path.read_bytes())
+
+
+def make_flat_index(dim: int) -> faiss.Index:
+    if FLAT_INDEX_TYPE != "sq8":
+        return faiss.IndexFlatIP(dim)
+    # Unit vectors stay within [-1, 1], so the quantizer range is fixed rather than trained.
+    index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit_uniform, faiss.METRIC_INNER_PRODUCT)
+    index.train(np.array([[-1.0] * dim, [1.0] * dim], dtype=np.float32))
+    return index
+
+
+def make_index(dim: int, vectors: np.ndarray) -> faiss.Index:
+    if len(vectors) < ANN_INDEX_THRESHOLD:
+        return make_flat_index(dim)
+    if ANN_INDEX_TYPE == "ivf_sq8":
+        nlist = max(1, min(IVF_NLIST or int(4 * math.sqrt(len(vectors))), len(vectors) // 39))
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+        index.nprobe = IVF_NPROBE
+        return index
+    if ANN_INDEX_TYPE == "pq_fastscan":
+        # The number of sub-quantizers must divide the dimension.
+        m = PQ_M or max((divisor for divisor in range(1, dim // 2 + 1) if dim % divisor == 0), default=1)
+        index = faiss.IndexPQFastScan(dim, m, 4, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+        return index
+    index = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+    index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    index.hnsw.efSearch = HNSW_EF_SEARCH
+    return index
+
+
+def index_vectors(index: faiss.Index) -> np.ndarray:
+    if isinstance(index, faiss.IndexIVF):
+        index.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def grow_index(index: faiss.IndexIDMap2, incoming: np.ndarray) -> faiss.IndexIDMap2:
+    inner = faiss.downcast_index(index.index)
+    if not isinstance(inner, (faiss.IndexFlat, faiss.IndexScalarQuantizer)) or index.ntotal + len(incoming) < ANN_INDEX_THRESHOLD:
+        return index
+    existing = index_vectors(inner)
+    upgraded = faiss.IndexIDMap2(make_index(index.d, np.vstack([existing, incoming])))
+    if index.ntotal:
+        upgraded.add_with_ids(existing, faiss.vector_to_array(index.id_map))
+    return upgraded
+
+
+def write_index_atomic(index: faiss.Index, path: Path) -> None:
+    temp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    faiss.write_index(index, str(temp_path))
+    os.replace(temp_path, path)
+
+
+def write_index_info(source_id: str, index: faiss.Index) -> None:
+    path = index_info_path(source_id)
+    temp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    temp_path.write_bytes(orjson.dumps({"dim": int(index.d), "ntotal": int(index.ntotal)}))
+    os.replace(temp_path, path)
+
+
+def read_index_info(source_id: str) -> dict[str, int] | None:
+    try:
+        return orjson.loads(index_info_path(source_id).read_bytes())
+    except (FileNotFoundError, orjson.JSONDecodeError):
+        return None
+
+
+def dimension_mismatch(existing_dim: int, incoming_dim: int) -> ApiError:
+    return ApiError(
+        code="INDEX_DIMENSION_MISMATCH",
+        message="Existing FAISS index dimension does not match incoming vectors",
+        status_code=409,
+        details={"existing_dim": existing_dim, "incoming_dim": incoming_dim},
+    )
 
 
-def get_query_vector_from_text(query_text: str, request_id: str) -> list[float]:
-    embedding_url = os.getenv("EMBEDDING_URL", "http://embedding:8000")
+def upgrade_positional_index(source_id: str, index: faiss.Index) -> faiss.IndexIDMap2:
+    items = load_legacy_meta(source_id)
+    ids = np.fromiter(
+        (chunk_key(items[position].get("chunk_id", "") if position < len(items) else f"#{position}") for position in range(index.ntotal)),
+        dtype=np.int64,
+        count=index.ntotal,
+    )
+    if items:
+        store_meta(source_id, ids[: len(items)], items[: index.ntotal])
+    vectors = index_vectors(index)
+    upgraded = faiss.IndexIDMap2(make_index(index.d, vectors))
+    upgraded.add_with_ids(vectors, ids)
+    write_index_atomic(upgraded, index_path(source_id))
+    legacy_meta_path(source_id).unlink(missing_ok=True)
+    return upgraded
+
+
+def read_index(source_id: str, read_only: bool) -> faiss.IndexIDMap2:
+    path = index_path(source_id)
+    # Memory-mapped indices must never be added to; writers always load a private writable copy.
+    index = faiss.read_index(str(path), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if read_only else 0)
+    if not isinstance(index, faiss.IndexIDMap2):
+        with LEGACY_UPGRADE_LOCK:
+            # Another reader may have converted the file while this one waited.
+            index = faiss.read_index(str(path))
+            if not isinstance(index, faiss.IndexIDMap2):
+                index = upgrade_positional_index(source_id, index)
+    inner = faiss.downcast_index(index.index)
+    if isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efSearch = HNSW_EF_SEARCH
+    elif isinstance(inner, faiss.IndexIVF):
+        inner.nprobe = IVF_NPROBE
+    return index
+
+
+def load_index(source_id: str, writable: bool = False) -> faiss.IndexIDMap2 | None:
+    path = index_path(source_id)
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        forget_index(source_id)
+        return None
+
+    with INDEX_CACHE_LOCK:
+        cached = INDEX_CACHE.get(source_id)
+    if cached is None or cached[0] != stat.st_mtime_ns or (writable and cached[2]):
+        read_only = not writable and stat.st_size >= INDEX_MMAP_MIN_BYTES
+        index = read_index(source_id, read_only)
+        cached = (path.stat().st_mtime_ns, index, read_only)
+    remember_index(source_id, cached)
+    return cached[1]
+
+
+def remember_index(source_id: str, entry: tuple[int, faiss.IndexIDMap2, bool]) -> None:
+    with INDEX_CACHE_LOCK:
+        INDEX_CACHE.pop(source_id, None)
+        INDEX_CACHE[source_id] = entry
+        while len(INDEX_CACHE) > INDEX_CACHE_SIZE:
+            INDEX_CACHE.pop(next(iter(INDEX_CACHE)))
+
+
+def forget_index(source_id: str) -> None:
+    with INDEX_CACHE_LOCK:
+        INDEX_CACHE.pop(source_id, None)
+
+
+async def get_query_vector_from_text(query_text: str, request_id: str) -> list[float]:
     payload = {
         "chunks": [
             {
@@ -108,11 +448,10 @@ def get_query_vector_from_text(query_text: str, request_id: str) -> list[float]:
             }
         ]
     }
-    response = httpx.post(
-        f"{embedding_url}/embed",
-        json=payload,
-        headers={"X-Request-Id": request_id},
-        timeout=30.0,
+    response = await get_embedding_client().post(
+        "/embed",
+        content=orjson.dumps(payload),
+        headers={"Content-Type": "application/json", "X-Request-Id": request_id},
     )
 
     if response.status_code >= 400:
@@ -123,7 +462,7 @@ def get_query_vector_from_text(query_text: str, request_id: str) -> list[float]:
             details={"status_code": response.status_code, "body": response.text[:500]},
         )
 
-    data = response.json()
+    data = orjson.loads(response.content)
     embeddings = data.get("embeddings", [])
     if not embeddings:
         raise ApiError(code="EMPTY_QUERY_VECTOR", message="Embedding provider returned no vectors", status_code=502)
@@ -175,94 +514,135 @@ def index_chunks(payload: IndexRequest) -> IndexResponse:
     dim = payload.embeddings[0].dim
     if dim <= 0:
         raise ApiError(code="INVALID_DIM", message="Embedding dim must be positive", status_code=400)
+    info = read_index_info(payload.source_id)
+    if info is not None and info["dim"] != dim:
+        raise dimension_mismatch(info["dim"], dim)
 
-    for item in payload.embeddings:
-        if item.dim != dim:
-            raise ApiError(code="MIXED_DIM", message="All embeddings must share the same dimension", status_code=400)
-        if len(item.vector) != dim:
-            raise ApiError(
-                code="DIMENSION_MISMATCH",
-                message="Vector length does not match embedding dim",
-                status_code=400,
-                details={"chunk_id": item.chunk_id},
-            )
-
-    chunk_map = {chunk.chunk_id: chunk.model_dump() for chunk in payload.chunks}
-    vectors = np.array([embedding.vector for embedding in payload.embeddings], dtype=np.float32)
+    vectors = embeddings_to_matrix(payload.embeddings, dim)
+    records = chunk_records(payload.embeddings, payload.chunks)
+    ids = np.fromiter((chunk_key(item.chunk_id) for item in payload.embeddings), dtype=np.int64, count=len(payload.embeddings))
     faiss.normalize_L2(vectors)
 
-    with LOCK:
+    with source_lock(payload.source_id).write():
         path = index_path(payload.source_id)
-        if path.exists():
-            index = faiss.read_index(str(path))
+        index = load_index(payload.source_id, writable=True)
+        if index is not None:
             if index.d != dim:
+                raise dimension_mismatch(int(index.d), dim)
+            index = grow_index(index, vectors)
+        else:
+            index = faiss.IndexIDMap2(make_index(dim, vectors))
+
+        # The cached index is extended in place, so drop it if persisting fails halfway.
+        forget_index(payload.source_id)
+        index.add_with_ids(vectors, ids)
+        store_meta(payload.source_id, ids, records)
+        write_index_atomic(index, path)
+        write_index_info(payload.source_id, index)
+        stat = path.stat()
+        if stat.st_size < INDEX_MMAP_MIN_BYTES:
+            remember_index(payload.source_id, (stat.st_mtime_ns, index, False))
+
+    return IndexResponse(source_id=payload.source_id, indexed=len(payload.embeddings))
+
+
+def query_buffer(rows: int, dim: int) -> np.ndarray:
+    if rows > QUERY_BUFFER_MAX_ROWS:
+        return np.empty((rows, dim), dtype=np.float32)
+    buffer = getattr(query_buffers, "matrix", None)
+    if buffer is None or buffer.shape[1] != dim or buffer.shape[0] < rows:
+        buffer = query_buffers.matrix = np.empty((max(rows, 1), dim), dtype=np.float32)
+    return buffer[:rows]
+
+
+def search_index(
+    source_id: str,
+    query_vectors: list[list[float]],
+    top_k: int,
+    normalized: bool = False,
+) -> list[list[dict[str, Any]]]:
+    with source_lock(source_id).read():
+        index = load_index(source_id)
+        if index is None or index.ntotal == 0:
+            return [[] for _ in query_vectors]
+        for query_vector in query_vectors:
+            if len(query_vector) != index.d:
                 raise ApiError(
-                    code="INDEX_DIMENSION_MISMATCH",
-                    message="Existing FAISS index dimension does not match incoming vectors",
-                    status_code=409,
-                    details={"existing_dim": int(index.d), "incoming_dim": dim},
+                    code="QUERY_DIMENSION_MISMATCH",
+                    message="Query vector dimension does not match index",
+                    status_code=400,
+                    details={"index_dim": int(index.d), "query_dim": len(query_vector)},
                 )
-        else:
-            index = faiss.IndexFlatIP(dim)
 
-        index.add(vectors)
-        faiss.write_index(index, str(path))
+        queries = query_buffer(len(query_vectors), index.d)
+        for row, query_vector in enumerate(query_vectors):
+            queries[row] = query_vector
+        if not normalized:
+            faiss.normalize_L2(queries)
+        limit = min(top_k, index.ntotal)
+        scores, labels = index.search(queries, limit)
+
+    metadata = fetch_meta(source_id, set(labels[labels >= 0].tolist()))
+    batches: list[list[dict[str, Any]]] = []
+    for row_scores, row_labels in zip(scores.tolist(), labels.tolist()):
+        results = [
+            {
+                "chunk_id": item.get("chunk_id", ""),
+                "text": item.get("text", ""),
+                "metadata": item.get("metadata", {}),
+                "score": score,
+            }
+            for label, score in zip(row_labels, row_scores)
+            if (item := metadata.get(label)) is not None
+        ]
+        batches.append(results)
+    return batches
 
-        meta_items = load_meta(payload.source_id)
-        for embedding in payload.embeddings:
-            metadata = chunk_map.get(embedding.chunk_id, {"chunk_id": embedding.chunk_id, "text": "", "metadata": {}})
-            meta_items.append(metadata)
-        save_meta(payload.source_id, meta_items)
 
-    return IndexResponse(source_id=payload.source_id, indexed=len(payload.embeddings))
+def warm_index(source_id: str) -> None:
+    with source_lock(source_id).read():
+        load_index(source_id)
 
 
 @app.post("/search", response_model=SearchResponse)
-def search(payload: SearchRequest, request: Request) -> SearchResponse:
+async def search(payload: SearchRequest, request: Request) -> ORJSONResponse:
     if payload.top_k <= 0:
         raise ApiError(code="INVALID_TOP_K", message="top_k must be greater than zero", status_code=400)
 
-    path = index_path(payload.source_id)
-    if not path.exists():
-        return SearchResponse(results=[])
+    if not index_path(payload.source_id).exists():
+        return ORJSONResponse({"results": []})
 
     query_vector = payload.query_vector
+    normalized = payload.query_is_normalized and query_vector is not None
     if query_vector is None:
         if not payload.query_text:
             raise ApiError(code="MISSING_QUERY", message="Provide query_vector or query_text", status_code=400)
-        query_vector = get_query_vector_from_text(payload.query_text, getattr(request.state, "request_id", str(uuid.uuid4())))
+        query_vector, _ = await asyncio.gather(
+            get_query_vector_from_text(payload.query_text, getattr(request.state, "request_id", str(uuid.uuid4()))),
+            asyncio.to_thread(warm_index, payload.source_id),
+        )
 
-    with LOCK:
-        index = faiss.read_index(str(path))
-        if len(query_vector) != index.d:
-            raise ApiError(
-                code="QUERY_DIMENSION_MISMATCH",
-                message="Query vector dimension does not match index",
-                status_code=400,
-                details={"index_dim": int(index.d), "query_dim": len(query_vector)},
-            )
+    results = await asyncio.to_thread(search_index, payload.source_id, [query_vector], payload.top_k, normalized)
+    return ORJSONResponse({"results": results[0]})
 
-        metadata = load_meta(payload.source_id)
-        if not metadata:
-            return SearchResponse(results=[])
-
-        query = np.array([query_vector], dtype=np.float32)
-        faiss.normalize_L2(query)
-        limit = min(payload.top_k, len(metadata))
-        scores, indices = index.search(query, limit)
-
-    results: list[SearchResult] = []
-    for rank, idx in enumerate(indices[0]):
-        if idx < 0 or idx >= len(metadata):
-            continue
-        item = metadata[idx]
-        results.append(
-            SearchResult(
-                chunk_id=item.get("chunk_id", ""),
-                text=item.get("text", ""),
-                metadata=item.get("metadata", {}),
-                score=float(scores[0][rank]),
-            )
+
+@app.post("/search_batch", response_model=SearchBatchResponse)
+def search_batch(payload: SearchBatchRequest) -> ORJSONResponse:
+    if payload.top_k <= 0:
+        raise ApiError(code="INVALID_TOP_K", message="top_k must be greater than zero", status_code=400)
+    if not payload.query_vectors:
+        raise ApiError(code="MISSING_QUERY", message="Provide at least one query vector", status_code=400)
+    if len(payload.query_vectors) > MAX_BATCH_QUERIES:
+        raise ApiError(
+            code="TOO_MANY_QUERIES",
+            message="Too many query vectors in one batch",
+            status_code=400,
+            details={"max_queries": MAX_BATCH_QUERIES},
         )
 
-    return SearchResponse(results=results)
+    if not index_path(payload.source_id).exists():
+        return ORJSONResponse({"results": [[] for _ in payload.query_vectors]})
+
+    return ORJSONResponse(
+        {"results": search_index(payload.source_id, payload.query_vectors, payload.top_k, payload.query_is_normalized)}
+    )
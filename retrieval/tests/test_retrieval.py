@@ -1,15 +1,54 @@
 import importlib
+import json
+import os
+import subprocess
+import sys
+import threading
+from pathlib import Path
 
+import numpy as np
+import pytest
 from fastapi.testclient import TestClient
 
 
-def load_app(monkeypatch, tmp_path):
+def load_app(monkeypatch, tmp_path, **env: str):
     monkeypatch.setenv("FAISS_DATA_DIR", str(tmp_path))
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
     module = importlib.import_module("app.main")
     module = importlib.reload(module)
     return module.app
 
 
+def random_vectors(count: int, dim: int = 8) -> np.ndarray:
+    return np.random.default_rng(7).normal(size=(count, dim)).astype(np.float32)
+
+
+def index_vectors(client: TestClient, vectors, start: int = 0, with_chunks: bool = True, source_id: str = "source-1"):
+    chunk_ids = [f"chunk-{start + row}" for row in range(len(vectors))]
+    payload = {
+        "source_id": source_id,
+        "embeddings": [
+            {"chunk_id": chunk_id, "vector": list(map(float, vector)), "dim": len(vector)}
+            for chunk_id, vector in zip(chunk_ids, vectors)
+        ],
+        "chunks": [
+            {"chunk_id": chunk_id, "document_id": "doc-1", "index": start + row, "text": chunk_id}
+            for row, chunk_id in enumerate(chunk_ids)
+        ]
+        if with_chunks
+        else [],
+    }
+    response = client.post("/index", json=payload)
+    assert response.status_code == 200
+    return response
+
+
+def top_chunks(client: TestClient, vector, top_k: int = 1, source_id: str = "source-1") -> list[str]:
+    response = client.post("/search", json={"source_id": source_id, "query_vector": list(map(float, vector)), "top_k": top_k})
+    return [result["chunk_id"] for result in response.json()["results"]]
+
+
 def test_index_and_search_with_query_vector(monkeypatch, tmp_path):
     app = load_app(monkeypatch, tmp_path)
     client = TestClient(app)
@@ -38,3 +77,229 @@ def test_index_and_search_with_query_vector(monkeypatch, tmp_path):
     results = search_response.json()["results"]
     assert len(results) == 1
     assert results[0]["chunk_id"] == "chunk-1"
+
+
+def test_search_sees_chunks_indexed_after_cache_warmup(monkeypatch, tmp_path):
+    client = TestClient(load_app(monkeypatch, tmp_path))
+
+    index_vectors(client, [[1.0, 0.0]], start=1)
+    assert top_chunks(client, [0.0, 1.0]) == ["chunk-1"]
+
+    index_vectors(client, [[0.0, 1.0]], start=2)
+    assert top_chunks(client, [0.0, 1.0]) == ["chunk-2"]
+
+
+def test_misaligned_chunks_are_matched_to_embeddings_by_id(monkeypatch, tmp_path):
+    client = TestClient(load_app(monkeypatch, tmp_path))
+    response = client.post(
+        "/index",
+        json={
+            "source_id": "source-1",
+            "embeddings": [
+                {"chunk_id": "chunk-1", "vector": [1.0, 0.0], "dim": 2},
+                {"chunk_id": "chunk-2", "vector": [0.0, 1.0], "dim": 2},
+            ],
+            "chunks": [
+                {"chunk_id": "chunk-2", "document_id": "doc-1", "index": 1, "text": "beta"},
+                {"chunk_id": "orphan", "document_id": "doc-1", "index": 2, "text": "unused"},
+            ],
+        },
+    )
+    assert response.status_code == 200
+
+    response = client.post("/search", json={"source_id": "source-1", "query_vector": [1.0, 1.0], "top_k": 2})
+    texts = {result["chunk_id"]: result["text"] for result in response.json()["results"]}
+    assert texts == {"chunk-1": "", "chunk-2": "beta"}
+
+
+def test_flat_index_is_upgraded_to_hnsw_past_threshold(monkeypatch, tmp_path):
+    app = load_app(monkeypatch, tmp_path, ANN_INDEX_THRESHOLD="3")
+    module = importlib.import_module("app.main")
+    client = TestClient(app)
+
+    vectors = [[1.0, 0.0], [0.0, 1.0], [1.0, 1.0], [-1.0, 0.5]]
+    for position, vector in enumerate(vectors):
+        index_vectors(client, [vector], start=position)
+
+    index = module.load_index("source-1")
+    assert isinstance(module.faiss.downcast_index(index.index), module.faiss.IndexHNSW)
+    assert index.ntotal == len(vectors)
+    assert top_chunks(client, [0.0, 1.0]) == ["chunk-1"]
+
+
+@pytest.mark.parametrize(
+    ("index_type", "count", "expected_type", "top_k"),
+    [("ivf_sq8", 200, "IndexIVFScalarQuantizer", 1), ("pq_fastscan", 1000, "IndexPQFastScan", 10)],
+)
+def test_ann_index_is_trained_on_first_large_batch(monkeypatch, tmp_path, index_type, count, expected_type, top_k):
+    app = load_app(monkeypatch, tmp_path, ANN_INDEX_THRESHOLD="100", ANN_INDEX_TYPE=index_type)
+    module = importlib.import_module("app.main")
+    client = TestClient(app)
+
+    vectors = random_vectors(count)
+    index_vectors(client, vectors, with_chunks=False)
+
+    index = module.load_index("source-1")
+    assert isinstance(module.faiss.downcast_index(index.index), getattr(module.faiss, expected_type))
+    assert index.is_trained and index.ntotal == count
+    assert "chunk-42" in top_chunks(client, vectors[42], top_k=top_k)
+
+
+def test_pq_fastscan_accepts_one_dimensional_vectors(monkeypatch, tmp_path):
+    client = TestClient(load_app(monkeypatch, tmp_path, ANN_INDEX_THRESHOLD="100", ANN_INDEX_TYPE="pq_fastscan"))
+
+    index_vectors(client, random_vectors(200, dim=1), with_chunks=False)
+
+    assert len(top_chunks(client, [1.0], top_k=5)) == 5
+
+
+def test_positional_index_with_json_metadata_is_upgraded(monkeypatch, tmp_path):
+    app = load_app(monkeypatch, tmp_path)
+    module = importlib.import_module("app.main")
+    legacy = module.faiss.IndexFlatIP(2)
+    legacy.add(np.array([[1.0, 0.0], [0.0, 1.0]], dtype=np.float32))
+    module.faiss.write_index(legacy, str(tmp_path / "index_source-1.faiss"))
+    items = [
+        {"chunk_id": "chunk-1", "text": "альфа", "metadata": {"page": 1}},
+        {"chunk_id": "chunk-2", "text": "бета", "metadata": {"page": 2}},
+    ]
+    (tmp_path / "meta_source-1.json").write_text(json.dumps(items, ensure_ascii=False), encoding="utf-8")
+
+    response = TestClient(app).post("/search", json={"source_id": "source-1", "query_vector": [0.0, 1.0], "top_k": 1})
+
+    assert response.json()["results"][0]["text"] == "бета"
+    assert not (tmp_path / "meta_source-1.json").exists()
+    assert isinstance(module.faiss.read_index(str(tmp_path / "index_source-1.faiss")), module.faiss.IndexIDMap2)
+
+
+def test_positional_index_with_short_metadata_keeps_every_vector(monkeypatch, tmp_path):
+    app = load_app(monkeypatch, tmp_path)
+    module = importlib.import_module("app.main")
+    legacy = module.faiss.IndexFlatIP(2)
+    legacy.add(np.array([[1.0, 0.0], [0.0, 1.0]], dtype=np.float32))
+    module.faiss.write_index(legacy, str(tmp_path / "index_source-1.faiss"))
+    (tmp_path / "meta_source-1.json").write_text(json.dumps([{"chunk_id": "chunk-1", "text": "alpha"}]), encoding="utf-8")
+    client = TestClient(app)
+
+    response = client.post("/search", json={"source_id": "source-1", "query_vector": [1.0, 1.0], "top_k": 2})
+
+    assert [result["text"] for result in response.json()["results"]] == ["alpha"]
+    assert module.load_index("source-1").ntotal == 2
+
+
+def test_source_lock_allows_parallel_readers_but_excludes_writer(monkeypatch, tmp_path):
+    load_app(monkeypatch, tmp_path)
+    module = importlib.import_module("app.main")
+    lock = module.source_lock("source-1")
+    assert module.source_lock("source-1") is lock
+
+    events: list[str] = []
+    with lock.read():
+        with lock.read():
+            events.append("second reader")
+
+        def write() -> None:
+            with lock.write():
+                events.append("writer")
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        writer.join(timeout=0.2)
+        assert writer.is_alive()
+        events.append("reader done")
+
+    writer.join(timeout=2)
+    assert events == ["second reader", "reader done", "writer"]
+
+
+def test_search_batch_answers_each_query_in_order(monkeypatch, tmp_path):
+    client = TestClient(load_app(monkeypatch, tmp_path))
+    index_vectors(client, [[1.0, 0.0], [0.0, 1.0]], start=1, with_chunks=False)
+
+    response = client.post(
+        "/search_batch",
+        json={"source_id": "source-1", "query_vectors": [[0.0, 1.0], [1.0, 0.0]], "top_k": 1},
+    )
+
+    assert response.status_code == 200
+    assert [batch[0]["chunk_id"] for batch in response.json()["results"]] == ["chunk-2", "chunk-1"]
+
+    response = client.post("/search_batch", json={"source_id": "source-1", "query_vectors": [[1.0, 0.0], [1.0]]})
+    assert response.json()["error"]["code"] == "QUERY_DIMENSION_MISMATCH"
+
+
+def test_large_indices_are_mapped_read_only_and_reopened_for_writes(monkeypatch, tmp_path):
+    app = load_app(monkeypatch, tmp_path, INDEX_MMAP_MIN_BYTES="1")
+    module = importlib.import_module("app.main")
+    client = TestClient(app)
+
+    for position, vector in enumerate([[1.0, 0.0], [0.0, 1.0]]):
+        index_vectors(client, [vector], start=position)
+
+    assert top_chunks(client, [0.0, 1.0]) == ["chunk-1"]
+    assert module.INDEX_CACHE["source-1"][2] is True
+
+
+def test_sq8_flat_index_stores_one_byte_per_component(monkeypatch, tmp_path):
+    app = load_app(monkeypatch, tmp_path, FLAT_INDEX_TYPE="sq8", ANN_INDEX_THRESHOLD="3")
+    module = importlib.import_module("app.main")
+    client = TestClient(app)
+
+    index_vectors(client, [[1.0, 0.0]], start=1)
+    index_vectors(client, [[0.0, 1.0]], start=2)
+    inner = module.faiss.downcast_index(module.load_index("source-1").index)
+    assert isinstance(inner, module.faiss.IndexScalarQuantizer) and inner.code_size == 2
+    assert top_chunks(client, [0.0, 1.0]) == ["chunk-2"]
+
+    index_vectors(client, [[1.0, 1.0]], start=3)
+    assert isinstance(module.faiss.downcast_index(module.load_index("source-1").index), module.faiss.IndexHNSW)
+
+
+def test_dimension_mismatch_is_rejected_from_info_sidecar(monkeypatch, tmp_path):
+    app = load_app(monkeypatch, tmp_path)
+    module = importlib.import_module("app.main")
+    client = TestClient(app)
+    index_vectors(client, [[1.0, 0.0]], with_chunks=False)
+    assert json.loads((tmp_path / "meta_source-1.info.json").read_text()) == {"dim": 2, "ntotal": 1}
+
+    def unexpected_load(*args, **kwargs):
+        raise AssertionError("index should not be loaded")
+
+    monkeypatch.setattr(module, "load_index", unexpected_load)
+    response = client.post(
+        "/index",
+        json={"source_id": "source-1", "embeddings": [{"chunk_id": "chunk-2", "vector": [1.0, 0.0, 0.0], "dim": 3}], "chunks": []},
+    )
+
+    assert response.status_code == 409
+    assert response.json()["error"]["details"] == {"existing_dim": 2, "incoming_dim": 3}
+
+
+def test_fetch_meta_splits_large_id_sets_and_batch_size_is_bounded(monkeypatch, tmp_path):
+    app = load_app(monkeypatch, tmp_path)
+    module = importlib.import_module("app.main")
+    ids = np.arange(1, 1201, dtype=np.int64)
+    module.store_meta("source-1", ids, [{"chunk_id": f"chunk-{key}"} for key in ids.tolist()])
+
+    metadata = module.fetch_meta("source-1", set(ids.tolist()))
+
+    assert len(metadata) == len(ids)
+    assert metadata[1200]["chunk_id"] == "chunk-1200"
+
+    response = TestClient(app).post("/search_batch", json={"source_id": "source-1", "query_vectors": [[1.0]] * 1000})
+    assert response.status_code == 400
+    assert response.json()["error"]["code"] == "TOO_MANY_QUERIES"
+
+
+def test_faiss_thread_count_applies_to_worker_threads(tmp_path):
+    script = (
+        "import threading, app.main, faiss\n"
+        "seen = []\n"
+        "worker = threading.Thread(target=lambda: seen.append(faiss.omp_get_max_threads()))\n"
+        "worker.start(); worker.join()\n"
+        "print(seen[0], faiss.cvar.distance_compute_blas_threshold)\n"
+    )
+    env = {**os.environ, "FAISS_OMP_THREADS": "3", "FAISS_DATA_DIR": str(tmp_path), "PYTHONPATH": str(Path(__file__).parents[1])}
+    output = subprocess.run([sys.executable, "-c", script], env=env, capture_output=True, text=True, check=True).stdout
+
+    assert output.split() == ["3", "16"]